@@ -0,0 +1,274 @@
+"""
+Load-test the flaskr endpoints against generated databases.
+
+    python benchmarks/bench.py --sizes 1000 100000 1000000
+    python benchmarks/bench.py --sizes 1000 --save benchmarks/baseline.json
+    python benchmarks/bench.py --sizes 1000 --compare benchmarks/baseline.json
+
+Every dataset is generated from a fixed seed, so runs are comparable.
+Each endpoint is driven through app.test_client() on one thread and through
+a threaded local HTTP server with several client threads, and the p50/p99
+latency, throughput and the peak RSS of the process are reported.
+With --compare the exit status is 1 if any p50 or p99 got slower than the
+baseline by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.cookiejar import CookieJar
+
+from werkzeug.security import generate_password_hash
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+from flaskr import create_app
+from flaskr.blog import make_excerpt
+from flaskr.db import init_db, get_db, close_pool
+
+WORDS = (
+    'flask sqlite index cursor page cache query writer reader template '
+    'stream search post author title body latency request worker commit'
+).split()
+
+PASSWORD_METHOD = 'pbkdf2:sha256:1000'
+
+
+# Fill a fresh database with users and posts generated from a fixed seed.
+def seed(app, posts, seed=0):
+    rng = random.Random(seed)
+    users = max(10, posts // 100)
+    pwhash = generate_password_hash('bench', PASSWORD_METHOD)
+    start = time.mktime((2020, 1, 1, 0, 0, 0, 0, 0, -1))
+
+    with app.app_context():
+        init_db()
+        db = get_db()
+
+        with db:
+            db.executemany(
+                'INSERT INTO user (username, password) VALUES (?, ?)',
+                ((f'user{n}', pwhash) for n in range(users))
+            )
+
+        for offset in range(0, posts, 10000):
+            rows = []
+            for n in range(offset, min(offset + 10000, posts)):
+                created_at = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(start + n * 60))
+                title = ' '.join(rng.choices(WORDS, k=4))
+                body = ' '.join(rng.choices(WORDS, k=rng.randint(20, 200)))
+                excerpt = make_excerpt(body, app.config['EXCERPT_LENGTH'])
+                rows.append((title, excerpt, body, rng.randint(1, users), created_at))
+
+            with db:
+                db.executemany(
+                    'INSERT INTO post (title, excerpt, body, author_id, created_at) VALUES (?, ?, ?, ?, ?)',
+                    rows
+                )
+
+        db.execute('ANALYZE')
+        post = db.execute(
+            'SELECT id, created_at FROM post WHERE author_id = 1 ORDER BY id LIMIT 1'
+        ).fetchone()
+        middle = db.execute(
+            'SELECT id, created_at FROM post ORDER BY id LIMIT 1 OFFSET ?', (posts // 2,)
+        ).fetchone()
+
+    return {
+        'own_post': post['id'],
+        'middle_cursor': f"{middle['created_at']},{middle['id']}",
+    }
+
+
+# The requests to time, as (name, method, path, form data, needs login).
+def endpoints(info):
+    return [
+        ('index', 'GET', '/', None, False),
+        ('index_deep', 'GET', '/?' + urllib.parse.urlencode({'before': info['middle_cursor']}), None, False),
+        ('get_post', 'GET', f"/{info['own_post']}/update", None, True),
+        ('search', 'GET', '/search?q=cursor+writer', None, False),
+        ('login', 'POST', '/auth/login', {'username': 'user0', 'password': 'bench'}, False),
+        ('create', 'POST', '/create', {'title': 'bench', 'body': 'bench'}, True),
+    ]
+
+
+def summarize(latencies, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 3),
+        'p99_ms': round(latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)] * 1000, 3),
+        'rps': round(len(latencies) / elapsed, 1),
+    }
+
+
+# Time each endpoint through the test client, one request after another.
+def drive_client(app, info, requests):
+    results = {}
+
+    for name, method, path, data, login in endpoints(info):
+        client = app.test_client()
+        if login:
+            client.post('/auth/login', data={'username': 'user0', 'password': 'bench'})
+
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(requests):
+            t = time.perf_counter()
+            response = client.open(path, method=method, data=data)
+            latencies.append(time.perf_counter() - t)
+            assert response.status_code < 400, (name, response.status_code)
+        results[name] = summarize(latencies, time.perf_counter() - started)
+
+    return results
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args):
+        pass
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args):
+        return None
+
+
+# Send one request, counting a redirect as the end of it like the test client does.
+def fetch(open_, url, body=None):
+    try:
+        open_.open(url, body).read()
+    except urllib.error.HTTPError as e:
+        if e.code >= 400:
+            raise
+
+
+# Time each endpoint over HTTP with several client threads against a threaded server.
+def drive_http(app, info, requests, threads):
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    base = f'http://127.0.0.1:{server.server_port}'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    results = {}
+
+    def opener(login):
+        open_ = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()), NoRedirect)
+        if login:
+            fetch(open_, base + '/auth/login', urllib.parse.urlencode(
+                {'username': 'user0', 'password': 'bench'}).encode())
+        return open_
+
+    try:
+        for name, method, path, data, login in endpoints(info):
+            latencies = []
+            openers = [opener(login) for _ in range(threads)]
+            body = urllib.parse.urlencode(data).encode() if data else None
+
+            def work(open_):
+                for _ in range(requests // threads):
+                    t = time.perf_counter()
+                    fetch(open_, base + path, body)
+                    latencies.append(time.perf_counter() - t)
+
+            workers = [threading.Thread(target=work, args=(o,)) for o in openers]
+            started = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            results[name] = summarize(latencies, time.perf_counter() - started)
+    finally:
+        server.shutdown()
+
+    return results
+
+
+def run(size, args):
+    fd, path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(fd)
+    app = create_app({
+        'DATABASE': path,
+        'PASSWORD_HASH_METHOD': PASSWORD_METHOD,
+        'PAGE_CACHE_SIZE': 256 if args.page_cache else 0,
+        # no job threads polling during the timed requests, and nothing written to the instance folder
+        'JOB_WORKERS': 0,
+        'TEMPLATE_CACHE_DIR': None,
+    })
+
+    try:
+        started = time.perf_counter()
+        info = seed(app, size)
+        print(f'seeded {size} posts in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+
+        result = {
+            'client': drive_client(app, info, args.requests),
+            'http': drive_http(app, info, args.requests, args.threads),
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+    finally:
+        close_pool(app)
+        os.unlink(path)
+
+    return result
+
+
+def report(results):
+    for size, result in results.items():
+        print(f"\n{size} posts, peak RSS {result['peak_rss_kb'] // 1024} MiB")
+        print(f"{'driver':8} {'endpoint':12} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>9}")
+        for driver in ('client', 'http'):
+            for name, stats in result[driver].items():
+                print(f"{driver:8} {name:12} {stats['p50_ms']:9.2f} {stats['p99_ms']:9.2f} {stats['rps']:9.1f}")
+
+
+# List every latency that got slower than the baseline by more than the tolerance.
+def compare(results, baseline, tolerance):
+    regressions = []
+
+    for size, result in results.items():
+        for driver in ('client', 'http'):
+            for name, stats in result[driver].items():
+                old = baseline.get(size, {}).get(driver, {}).get(name)
+                if old is None:
+                    continue
+                for key in ('p50_ms', 'p99_ms'):
+                    if stats[key] > old[key] * (1 + tolerance):
+                        regressions.append(f'{size} {driver} {name} {key}: {old[key]} -> {stats[key]}')
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--requests', type=int, default=200, help='requests per endpoint and driver')
+    parser.add_argument('--threads', type=int, default=8, help='client threads for the HTTP driver')
+    parser.add_argument('--page-cache', action='store_true', help='leave the page cache on')
+    parser.add_argument('--save', metavar='FILE', help='write the results as a new baseline')
+    parser.add_argument('--compare', metavar='FILE', help='fail on regressions against a baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown, 0.2 is 20%%')
+    args = parser.parse_args(argv)
+
+    results = {str(size): run(size, args) for size in args.sizes}
+    report(results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('slower:', regression)
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""
+Measure what reading a large listing costs per row for each row representation.
+
+    python benchmarks/rows.py --rows 100000
+
+Every variant reads the same posts with the columns of the index query and
+formats each created_at the way the index template does. Reported are the
+microseconds per row of the fastest of three runs, and the bytes per row
+allocated while the whole result is held in memory, as with fetchall().
+"""
+import argparse
+import sqlite3
+import sys
+import time
+import tracemalloc
+
+from flaskr.db import record_factory
+
+COLUMNS = 'id, title, excerpt, created_at, author_id, username'
+
+
+def make_db(rows, epoch, detect_types=0):
+    db = sqlite3.connect(':memory:', detect_types=detect_types)
+    db.execute(
+        'CREATE TABLE post (id INTEGER PRIMARY KEY, title TEXT, excerpt TEXT,'
+        ' created_at TIMESTAMP, author_id INTEGER, username TEXT)'
+    )
+    start = 1577836800
+    db.executemany(
+        'INSERT INTO post VALUES (?, ?, ?, ?, ?, ?)',
+        ((n, f'title {n}', 'x' * 300, start + n * 60 if epoch else None, 1, 'user') for n in range(rows))
+    )
+    if not epoch:
+        db.execute("UPDATE post SET created_at = datetime(? + id * 60, 'unixepoch')", (start,))
+    db.commit()
+    return db
+
+
+def measure(db, row_factory):
+    db.row_factory = row_factory
+    sql = f'SELECT {COLUMNS} FROM post ORDER BY id'
+
+    seconds = float('inf')
+    for _ in range(3):
+        started = time.perf_counter()
+        rows = db.execute(sql).fetchall()
+        for row in rows:
+            row['created_at'].strftime('%Y-%m-%d')
+        seconds = min(seconds, time.perf_counter() - started)
+        del rows
+
+    tracemalloc.start()
+    rows = db.execute(sql).fetchall()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return seconds / len(rows) * 1e6, size / len(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args(argv)
+
+    variants = [
+        ('sqlite3.Row, PARSE_DECLTYPES', make_db(args.rows, False, sqlite3.PARSE_DECLTYPES), sqlite3.Row),
+        ('Record, text timestamps', make_db(args.rows, False), record_factory),
+        ('Record, epoch timestamps', make_db(args.rows, True), record_factory),
+    ]
+
+    print(f"{'rows':30} {'us/row':>8} {'bytes/row':>10}")
+    for name, db, row_factory in variants:
+        us, size = measure(db, row_factory)
+        print(f'{name:30} {us:8.2f} {size:10.0f}')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
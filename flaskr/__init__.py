@@ -9,6 +9,44 @@ def create_app(test_config=None):
     app.config.from_mapping(
         SECRET_KEY='dev',
         DATABASE=os.path.join(app.instance_path, 'flaskr.sqlite'),
+        DATABASE_POOL_SIZE=5,
+        DATABASE_CACHE_SIZE=-16000,
+        DATABASE_MMAP_SIZE=64 * 1024 * 1024,
+        DATABASE_BUSY_TIMEOUT=5000,
+        DATABASE_SHARDS=1,
+        WRITE_GROUP_SIZE=64,
+        WRITE_GROUP_WINDOW=0.001,
+        WRITE_TIMEOUT=30,
+        QUERY_TIMING=False,
+        SLOW_QUERY_THRESHOLD=0.1,
+        METRICS=True,
+        METRICS_TOKEN=None,
+        POSTS_PER_PAGE=10,
+        SEARCH_MAX_PAGES=50,
+        STREAM_TEMPLATES=False,
+        TEMPLATE_CACHE_DIR=os.path.join(app.instance_path, 'jinja'),
+        WARM_UP=False,
+        ASSETS_DIR=os.path.join(app.instance_path, 'assets'),
+        COMPRESS=False,
+        COMPRESS_LEVEL=6,
+        COMPRESS_MIN_SIZE=500,
+        EXCERPT_LENGTH=300,
+        EPOCH_TIMESTAMPS=False,
+        PAGE_CACHE_SIZE=256,
+        PAGE_CACHE_TIMEOUT=60,
+        FRAGMENT_CACHE_SIZE=1024,
+        FRAGMENT_CACHE_TIMEOUT=3600,
+        USER_CACHE_SIZE=1024,
+        USER_CACHE_TIMEOUT=300,
+        PASSWORD_HASH_METHOD='scrypt',
+        PASSWORD_HASH_WORKERS=2,
+        PASSWORD_HASH_MAX_PENDING=8,
+        API_TOKEN_MAX_AGE=30 * 24 * 60 * 60,
+        JOB_WORKERS=2,
+        JOB_POLL_INTERVAL=1.0,
+        JOB_TIMEOUT=300,
+        JOB_MAX_ATTEMPTS=5,
+        JOB_RETRY_DELAY=10,
     )
     '''
     app = Flask(__name__, instance_relative_config=True) creates the Flask instance.
@@ -26,6 +64,43 @@ def create_app(test_config=None):
             but it should be overridden with a random value when deploying.
         DATABASE is the path where the SQLite database file will be saved. 
             It’s under app.instance_path, which is the path that Flask has chosen for the instance folder. 
+        DATABASE_POOL_SIZE is how many idle connections each worker process keeps open. 
+        DATABASE_CACHE_SIZE, DATABASE_MMAP_SIZE and DATABASE_BUSY_TIMEOUT are applied to every connection 
+            as the SQLite cache_size (negative means KiB), mmap_size (bytes) and busy_timeout (milliseconds) pragmas.
+        DATABASE_SHARDS spreads the posts over this many files next to DATABASE, by author, 
+            each with its own writer. Run flask rebalance-shards after changing it.
+        WRITE_GROUP_SIZE and WRITE_GROUP_WINDOW bound how many writes, arriving within how many seconds, 
+            are committed together by the writer thread. A size of 1 makes every request commit on its own. 
+            A request gives up on its write after WRITE_TIMEOUT seconds.
+        Every SQL statement is counted and timed for the Server-Timing header and /metrics, 
+            and statements slower than SLOW_QUERY_THRESHOLD seconds are logged. 
+            QUERY_TIMING also times reading their rows and counts the rows read, 
+            which is off by default, since it adds a Python call to every row. 
+            METRICS serves the latency histograms and counters on /metrics, 
+            to requests with METRICS_TOKEN as a bearer token, or only from localhost if there is no token.
+        POSTS_PER_PAGE is how many posts the index shows before linking to the next page.
+        SEARCH_MAX_PAGES is the last page of search results that can be asked for, each page reads all the matches before it.
+        EXCERPT_LENGTH is how many characters of each post the index shows, the rest is on the post's own page.
+        EPOCH_TIMESTAMPS stores post.created_at as integer seconds instead of text, which is smaller and quicker to compare. 
+            Run flask convert-timestamps after changing it, so old and new posts sort together.
+        STREAM_TEMPLATES sends the index page while it is being rendered instead of building it in memory first.
+        TEMPLATE_CACHE_DIR is where compiled templates are stored and shared between workers, None turns it off. 
+        WARM_UP compiles all templates and opens the pooled connections when the app is created.
+        ASSETS_DIR is where build-assets writes the fingerprinted and compressed static files, None turns them off.
+        COMPRESS gzips responses for clients that accept it, at COMPRESS_LEVEL from 1 (fastest) to 9 (smallest). 
+            Responses under COMPRESS_MIN_SIZE bytes are sent as they are, since compressing them saves almost nothing.
+        PAGE_CACHE_SIZE and PAGE_CACHE_TIMEOUT bound the rendered pages kept in memory, 
+            by count and by age in seconds. A size of 0 turns the page cache off.
+        FRAGMENT_CACHE_SIZE and FRAGMENT_CACHE_TIMEOUT do the same for the rendered posts the listings are made of.
+        USER_CACHE_SIZE and USER_CACHE_TIMEOUT do the same for the logged-in user records.
+        PASSWORD_HASH_METHOD is the werkzeug hashing method and cost for new password hashes, e.g. 'pbkdf2:sha256:600000'. 
+            PASSWORD_HASH_WORKERS threads compute hashes, and requests get a 503 response 
+            once PASSWORD_HASH_MAX_PENDING hashes are waiting.
+        API_TOKEN_MAX_AGE is how many seconds a token from /api/tokens can be used for.
+        JOB_WORKERS threads in every serving process run the background jobs from flaskr.jobs, 
+            looking for new ones every JOB_POLL_INTERVAL seconds, 0 leaves them to flask worker. 
+            A job that hasn't finished JOB_TIMEOUT seconds after it was taken is taken again, 
+            and a failed job is retried after JOB_RETRY_DELAY seconds, doubling each time, up to JOB_MAX_ATTEMPTS attempts.
     '''
 
     if test_config is None:
@@ -54,8 +129,11 @@ def create_app(test_config=None):
         but it needs to be created because your project will create the SQLite database file there.
     '''
 
+    from .auth import skip_user
+
     # a simple page that says hello
     @app.route('/hello')
+    @skip_user
     def hello():
         return 'Hello, world!'
 
@@ -70,11 +148,29 @@ def create_app(test_config=None):
     from . import db
     db.init_app(app)
 
+    # time requests and queries, and serve the metrics
+    from . import metrics
+    metrics.init_app(app)
+
+    # register the bulk import and export commands
+    from . import bulk
+    bulk.init_app(app)
+
+    # register the pre-forking serve command
+    from . import serve
+    serve.init_app(app)
+
+    # run background jobs, and register the worker command
+    from . import jobs
+    jobs.init_app(app)
+
     # register the blueprint from the factory
     from . import auth
     from . import blog
+    from . import api
     app.register_blueprint(auth.bp)
     app.register_blueprint(blog.bp)
+    app.register_blueprint(api.bp)
 
     app.add_url_rule('/', endpoint='index')
     '''
@@ -84,4 +180,20 @@ def create_app(test_config=None):
     generating the same / URL either way.
     make url_for('index') == url_for('blog.index')
     '''
+
+    # compile templates to disk, and get ready for the first requests if asked to
+    from . import templating
+    templating.init_app(app)
+
+    # serve the fingerprinted static files once they have been built
+    from . import assets
+    assets.init_app(app)
+
+    # compress dynamic responses if asked to
+    from . import compress
+    compress.init_app(app)
+
+    if app.config['WARM_UP']:
+        templating.warm_up(app)
+
     return app
@@ -0,0 +1,237 @@
+import functools
+import hashlib
+
+from flask import Blueprint, request, g, jsonify, url_for, abort, current_app
+from itsdangerous import URLSafeTimedSerializer, BadSignature
+from werkzeug.exceptions import HTTPException
+
+from flaskr.auth import get_user_cache, skip_user
+from flaskr.blog import get_page, get_post, find_post, insert_post
+from flaskr.db import get_read_db
+from flaskr.passwords import check_password
+from flaskr.queries import SQL
+
+bp = Blueprint('api', __name__, url_prefix='/api')
+
+# The fields each kind of response can have, in the order they are sent.
+LIST_FIELDS = ('id', 'title', 'excerpt', 'created_at', 'author_id', 'username')
+DETAIL_FIELDS = ('id', 'title', 'body', 'created_at', 'author_id', 'username')
+
+
+def get_serializer():
+    return URLSafeTimedSerializer(current_app.secret_key, salt='flaskr.api.token')
+
+
+# Make a token that stands in for the user's session, signed with the SECRET_KEY.
+def make_token(user_id):
+    return get_serializer().dumps(user_id)
+
+
+# Load the user whose token is in the Authorization header, if there is one.
+@bp.before_request
+def load_token_user():
+    g.user = None
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+
+    if scheme.lower() != 'bearer' or not token:
+        return
+
+    try:
+        user_id = get_serializer().loads(token, max_age=current_app.config['API_TOKEN_MAX_AGE'])
+    except BadSignature:
+        abort(401, 'Invalid or expired token.')
+
+    cache = get_user_cache(current_app)
+    g.user = cache.get(user_id)
+
+    if g.user is None:
+        g.user = get_read_db().execute(SQL['user_by_id'], (user_id,)).fetchone()
+
+        if g.user is None:
+            abort(401, 'Invalid or expired token.')
+        cache.set(user_id, g.user)
+
+    '''
+    The token carries the user id and the time it was made, signed like the session cookie,
+    so checking it needs no lookup, and the user record comes from the same cache the session uses.
+    Every view here is marked with skip_user, so the session cookie is never read for the API.
+    '''
+
+
+# View decorator for API views that need a token.
+def token_required(view):
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        if g.user is None:
+            abort(401, 'A token is required.')
+
+        return view(**kwargs)
+
+    return wrapped_view
+
+
+# Send errors as JSON instead of HTML pages.
+@bp.errorhandler(HTTPException)
+def handle_error(e):
+    response = jsonify(error=e.description)
+    response.status_code = e.code
+
+    if e.code == 401:
+        response.headers['WWW-Authenticate'] = 'Bearer'
+    for name, value in e.get_headers():
+        if name == 'Retry-After':
+            response.headers[name] = value
+
+    return response
+
+
+def get_fields(allowed):
+    """
+    param allowed: the fields the response can have
+    return: the fields asked for with ?fields=, or all of them
+    raise 400: if an unknown field is asked for
+    """
+    fields = request.args.get('fields')
+
+    if not fields:
+        return allowed
+
+    fields = tuple(name.strip() for name in fields.split(','))
+    unknown = set(fields) - set(allowed)
+
+    if unknown:
+        abort(400, f"Unknown fields: {', '.join(sorted(unknown))}.")
+
+    return fields
+
+
+# The JSON object in the request body, or the form if there is no JSON and that is allowed.
+def get_object(form=False):
+    """
+    return: the JSON object sent, or request.form
+    raise 400: if the body is JSON but not an object
+    """
+    data = request.get_json(silent=True)
+
+    if data is None:
+        return request.form if form else {}
+    if not isinstance(data, dict):
+        abort(400, 'Expected a JSON object.')
+
+    return data
+
+
+def post_json(post, fields):
+    data = {name: post[name] for name in fields}
+
+    if 'created_at' in data:
+        data['created_at'] = data['created_at'].isoformat()
+
+    return data
+
+
+# An ETag for a response made of these posts, from their ids and versions alone.
+def make_etag(posts, *extra):
+    key = repr([(post['id'], post['version']) for post in posts] + list(extra))
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+# Answer with 304 Not Modified if the client already has this response, and only build it otherwise.
+def conditional(etag, build):
+    """
+    param etag: the ETag of the response, computed without building it
+    param build: function that returns the response
+    return: an empty 304 response, or the built response with the ETag
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = build()
+
+    response.set_etag(etag)
+    return response
+
+    '''
+    post.version goes up with every edit, and usernames never change, 
+    so the ids and versions of the posts tell whether a response changed without reading their bodies. 
+    A client that sends the ETag back as If-None-Match gets an empty 304 after one small query, 
+    with no full query and no JSON.
+    An edit between the two queries can send a new body with the old ETag, 
+    which only costs that client one more full response.
+    '''
+
+
+# List the posts, most recent first, one page at a time.
+@bp.route('/posts')
+@skip_user
+def posts():
+    fields = get_fields(LIST_FIELDS)
+    versions = get_page('post_versions')
+    etag = make_etag(list(versions), versions.has_next, fields)
+
+    def build():
+        page = get_page('posts')
+        data = [post_json(post, fields) for post in page]
+
+        return jsonify(
+            posts=data,
+            next=page.next_cursor and url_for('api.posts', before=page.next_cursor, fields=request.args.get('fields')),
+            prev=page.prev_cursor and url_for('api.posts', after=page.prev_cursor, fields=request.args.get('fields')),
+        )
+
+    return conditional(etag, build)
+
+    '''
+    The pages use the same before/after cursors as the index, and next and prev are ready-made URLs,
+    so clients never have to build a cursor themselves.
+    The cursors come from created_at and id, which edits don't change, 
+    so the posts on the page and whether another page follows are all the ETag needs.
+    '''
+
+
+# Show a single post with its full body.
+@bp.route('/posts/<int:id>')
+@skip_user
+def post(id):
+    fields = get_fields(DETAIL_FIELDS)
+    version = find_post(id, check_author=False, name='post_version')[1]
+
+    return conditional(
+        make_etag([version], fields),
+        lambda: jsonify(post_json(get_post(id, check_author=False), fields)),
+    )
+
+
+# Create a new post for the user of the token.
+@bp.route('/posts', methods=('POST',))
+@skip_user
+@token_required
+def create():
+    data = get_object()
+    title = data.get('title')
+    body = data.get('body', '')
+
+    if not title or not isinstance(title, str) or not isinstance(body, str):
+        abort(400, 'Title is required.')
+
+    id = insert_post(title, body, g.user['id'])
+    return jsonify(id=id), 201, {'Location': url_for('api.post', id=id)}
+
+
+# Exchange a username and password for a token.
+@bp.route('/tokens', methods=('POST',))
+@skip_user
+def tokens():
+    data = get_object(form=True)
+    username = data.get('username')
+    password = data.get('password')
+
+    if not isinstance(username, str) or not isinstance(password, str):
+        abort(400, 'Username and password are required.')
+
+    user = get_read_db().execute(SQL['user_login'], (username,)).fetchone()
+
+    if user is None or not check_password(user['password'], password):
+        abort(401, 'Incorrect username or password.')
+
+    return jsonify(token=make_token(user['id']), expires_in=current_app.config['API_TOKEN_MAX_AGE'])
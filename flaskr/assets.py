@@ -0,0 +1,142 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+
+import click
+from flask import current_app, request, send_from_directory
+from flask.cli import with_appcontext
+
+# Content types worth compressing, the rest (images, fonts) are compressed already.
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'application/xml', 'image/svg+xml')
+
+# A year, the longest max-age browsers honour.
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def fingerprint(filename, data):
+    """
+    param filename: path of a static file, relative to the static folder
+    param data: its contents
+    return: the same path with a hash of the contents before the extension, e.g. style.0123456789ab.css
+    """
+    root, ext = os.path.splitext(filename)
+    return f'{root}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+
+
+def compressible(filename):
+    mimetype = mimetypes.guess_type(filename)[0] or ''
+    return mimetype.startswith(COMPRESSIBLE)
+
+
+# Copy every static file to the assets folder under its fingerprinted name, with a gzip variant next to it.
+def build_assets(app):
+    out = app.config['ASSETS_DIR']
+    manifest = {}
+
+    for dirpath, dirnames, filenames in os.walk(app.static_folder):
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            filename = os.path.relpath(path, app.static_folder).replace(os.sep, '/')
+
+            with open(path, 'rb') as f:
+                data = f.read()
+
+            hashed = fingerprint(filename, data)
+            target = os.path.join(out, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+
+            with open(target, 'wb') as f:
+                f.write(data)
+
+            if compressible(filename):
+                compressed = gzip.compress(data, 9, mtime=0)
+                if len(compressed) < len(data):
+                    with open(target + '.gz', 'wb') as f:
+                        f.write(compressed)
+
+            manifest[filename] = hashed
+
+    with open(os.path.join(out, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    app.extensions.pop('flaskr.assets', None)
+    return manifest
+
+    '''
+    The hash changes whenever the contents do, so a fingerprinted URL always means the same bytes
+    and browsers can keep it forever without asking again.
+    Compressing at level 9 is slow, but it only happens here, once per release, instead of on every request.
+    The old fingerprinted files are left in place, so pages rendered before a deploy can still load them.
+    '''
+
+
+def get_manifest(app):
+    """
+    param app: the Flask app
+    return: a dict from static filenames to their fingerprinted names, empty until build-assets has run
+    """
+    manifest = app.extensions.get('flaskr.assets')
+
+    if manifest is None:
+        manifest = {}
+        out = app.config['ASSETS_DIR']
+        if out and os.path.exists(os.path.join(out, 'manifest.json')):
+            with open(os.path.join(out, 'manifest.json')) as f:
+                manifest = json.load(f)
+        app.extensions['flaskr.assets'] = manifest
+
+    return manifest
+
+
+# Make url_for('static', filename=...) point at the fingerprinted file, if there is one.
+def fingerprint_url(endpoint, values):
+    if endpoint == 'static' and 'filename' in values:
+        values['filename'] = get_manifest(current_app).get(values['filename'], values['filename'])
+
+
+# Serve fingerprinted files from the assets folder, and anything else from the static folder as usual.
+def send_static_file(filename):
+    manifest = get_manifest(current_app)
+
+    if filename not in manifest.values():
+        return current_app.send_static_file(filename)
+
+    out = current_app.config['ASSETS_DIR']
+    gzipped = 'gzip' in request.accept_encodings and os.path.exists(os.path.join(out, filename + '.gz'))
+
+    if gzipped:
+        response = send_from_directory(out, filename + '.gz', mimetype=mimetypes.guess_type(filename)[0])
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = send_from_directory(out, filename)
+
+    if compressible(filename):
+        response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = IMMUTABLE
+    return response
+
+
+@click.command('build-assets')
+@with_appcontext
+def build_assets_command():
+    # Fingerprint and compress the static files, e.g. while building a release.
+    if not current_app.config['ASSETS_DIR']:
+        raise click.ClickException('ASSETS_DIR is not set, there is nowhere to store the assets.')
+
+    manifest = build_assets(current_app)
+    click.echo(f'Built {len(manifest)} assets')
+
+
+def init_app(app):
+    # Serve the built assets in place of the static files. This is called by the application factory.
+    app.url_defaults(fingerprint_url)
+    app.view_functions['static'] = send_static_file
+    app.cli.add_command(build_assets_command)
+
+    '''
+    Until build-assets has run the manifest is empty, and static files are served exactly as before.
+    The static endpoint keeps its name, so url_for('static', ...) in the templates doesn't change,
+    and the user loader still skips it.
+    '''
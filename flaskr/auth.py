@@ -1,9 +1,12 @@
 import functools
+import sqlite3
 
-from flask import Blueprint, request, redirect, url_for, flash, render_template, session, g
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Blueprint, request, redirect, url_for, flash, render_template, session, g, current_app
 
-from flaskr.db import get_db
+from flaskr.cache import LRUCache
+from flaskr.db import get_read_db, write
+from flaskr.passwords import hash_password, check_password, needs_rehash
+from flaskr.queries import SQL
 
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
@@ -15,7 +18,6 @@ def register():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        db = get_db()
         error = None
 
         # Validate that username and password are not empty.
@@ -28,13 +30,9 @@ def register():
         if error is None:
             # try to store the user
             try:
-                db.execute(
-                    'INSERT INTO user (username, password) VALUES (?, ?)',
-                    (username, generate_password_hash(password)),
-                )
-                db.commit()
+                write(SQL['user_insert'], (username, hash_password(password)))
             # check if the username already exists
-            except db.IntegrityError:
+            except sqlite3.IntegrityError:
                 error = f"User {username} is already registered."
             # redirect to the login page.
             else:
@@ -63,16 +61,19 @@ def register():
     The user will input their username and password.
     '''
     '''
-    db.execute 
+    write 
     takes a SQL query with ? placeholders for any user input, 
     and a tuple of values to replace the placeholders with. 
     The database library will take care of escaping the values so you are not vulnerable to a SQL injection attack.
     '''
     '''
     For security, passwords should never be stored in the database directly. 
-    Instead, generate_password_hash() is used to securely hash the password, 
+    Instead, hash_password() is used to securely hash the password, 
     and that hash is stored. 
-    Since this query modifies data, db.commit() needs to be called afterwards to save the changes.
+    The hash is computed on a small pool of worker threads, see flaskr.passwords, 
+    so a burst of registrations and logins can't take every CPU away from other requests. 
+    Since this query modifies data, it is handed to write(), 
+    which runs it on the single writer connection and commits it together with other concurrent writes.
     '''
     '''
     sqlite3.IntegrityError 
@@ -98,19 +99,21 @@ def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        db = get_db()
+        db = get_read_db()
         error = None
 
-        user = db.execute(
-            'SELECT * FROM user WHERE username = ?', (username,)
-        ).fetchone()
+        user = db.execute(SQL['user_login'], (username,)).fetchone()
 
         if user is None:
             error = 'Incorrect username.'
-        elif not check_password_hash(user['password'], password):
+        elif not check_password(user['password'], password):
             error = 'Incorrect password.'
 
         if error is None:
+            # upgrade hashes made with outdated parameters while the password is at hand
+            if needs_rehash(user['password']):
+                write(SQL['user_set_password'], (hash_password(password), user['id']))
+
             # store session, which will be available on subsequent requests.
             session.clear()
             session['user_id'] = user['id']
@@ -127,9 +130,11 @@ def login():
     If the query returned no results, it returns None. 
     '''
     '''
-    check_password_hash() 
+    check_password() 
     hashes the submitted password in the same way as the stored hash and securely compares them. 
-    If they match, the password is valid.
+    If they match, the password is valid. 
+    When the stored hash uses another method or cost than PASSWORD_HASH_METHOD, 
+    it is replaced by a new one, which is only possible now that the plain password is known.
     '''
     '''
     session is a dict that stores data across requests. 
@@ -146,27 +151,57 @@ def login():
     '''
 
 
-#  If a user id is stored in the session, load the user object from the database.
+def get_user_cache(app):
+    cache = app.extensions.get('flaskr.user_cache')
+
+    if cache is None:
+        cache = app.extensions['flaskr.user_cache'] = LRUCache(
+            max_size=app.config['USER_CACHE_SIZE'],
+            timeout=app.config['USER_CACHE_TIMEOUT'],
+        )
+
+    return cache
+
+
+# View decorator for views that never look at g.user, so the user isn't loaded for them.
+def skip_user(view):
+    view.skip_user = True
+    return view
+
+
+#  If a user id is stored in the session, load the user object from the cache or the database.
 @bp.before_app_request
 def load_logged_in_user():
+    endpoint = request.endpoint
+    if endpoint == 'static' or getattr(current_app.view_functions.get(endpoint), 'skip_user', False):
+        return
+
     user_id = session.get('user_id')
 
     if user_id is None:
         g.user = None
     else:
-        g.user = get_db().execute(
-            'SELECT * FROM user WHERE id = ?', (user_id,)
-        ).fetchone()
+        cache = get_user_cache(current_app)
+        g.user = cache.get(user_id)
+
+        if g.user is None:
+            g.user = get_read_db().execute(SQL['user_by_id'], (user_id,)).fetchone()
+
+            if g.user is not None:
+                cache.set(user_id, g.user)
 
     '''
     bp.before_app_request() 
     registers a function that runs before the view function, 
     no matter what URL is requested. 
+    Static files and views marked with skip_user don't need the user, so nothing is loaded for them.
     
     load_logged_in_user 
     checks if a user id is stored in the session and gets that user’s data from the database, 
     storing it on g.user, which lasts for the length of the request. 
     If there is no user id, or if the id doesn’t exist, g.user will be None.
+    Only the id and username are loaded, the views never need the password hash, 
+    and the row is kept in a small cache so most requests don't query the user table at all.
     '''
 
 
@@ -1,21 +1,280 @@
-from flask import Blueprint, render_template, request, flash, redirect, url_for, abort, g
+import itertools
+import re
+
+from flask import Blueprint, render_template, stream_template, request, flash, redirect, url_for, abort, g, current_app
+from markupsafe import Markup, escape
 
 from flaskr.auth import login_required
-from flaskr.db import get_db
+from flaskr.cache import cached_page, invalidate_pages, cached_fragment, invalidate_fragments
+from flaskr.db import (
+    get_read_db, get_shard_db, write, timestamp, read_shards, unbalanced_shards, shard_for, shards_for_post, scatter
+)
+from flaskr.queries import SQL
 
 bp = Blueprint('blog', __name__)
 
 
-# Show all the posts, most recent first.
+# Shorten a post body to at most length characters, without cutting a word in half.
+def make_excerpt(body, length):
+    if len(body) <= length:
+        return body
+
+    excerpt = body[:length]
+    if not body[length].isspace():
+        excerpt = re.sub(r'\s+\S*\Z', '', excerpt)
+
+    return excerpt.rstrip() + '…'
+
+    '''
+    The excerpt is stored next to the body when a post is written, 
+    so the index reads and sends a few hundred characters per post instead of every full body.
+    '''
+
+
+# Encode the (created_at, id) position of a post as an opaque page cursor.
+def encode_cursor(post):
+    return f"{post.raw('created_at')},{post['id']}"
+
+
+# Decode a page cursor back into a (created_at, id) pair.
+def decode_cursor(cursor):
+    """
+    param cursor: value produced by encode_cursor
+    return: (created_at, id) tuple to compare against the post index
+    raise 400: if the cursor is malformed
+    """
+    created_at, _, id = cursor.rpartition(',')
+
+    if not created_at or not id.isdigit():
+        abort(400, f"Invalid cursor {cursor!r}.")
+
+    return created_at, int(id)
+
+
+# One page of posts, read lazily from the cursor while the template renders it.
+class PostPage(object):
+    def __init__(self, rows, per_page, has_prev, has_next=False):
+        self._rows = rows
+        self.per_page = per_page
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.first = None
+        self.last = None
+
+    def __iter__(self):
+        # the cached page depends on every row read, including the look-ahead row
+        tags = g.setdefault('cache_tags', set())
+
+        try:
+            for n, row in enumerate(self._rows):
+                tags.add(f"post:{row['id']}")
+
+                if n == self.per_page:
+                    self.has_next = True
+                    break
+
+                if self.first is None:
+                    self.first = row
+                self.last = row
+                yield row
+        finally:
+            if hasattr(self._rows, 'close'):
+                self._rows.close()
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.last) if self.last is not None and self.has_next else None
+
+    @property
+    def prev_cursor(self):
+        return encode_cursor(self.first) if self.first is not None and self.has_prev else None
+
+    '''
+    The template loops over the page before it asks for the cursors, 
+    so by the time next_cursor is used the look-ahead row has shown whether another page follows.
+    '''
+
+
+# The position of a post in the listings, to merge the posts of several shards by.
+def post_position(post):
+    return post.raw('created_at'), post['id']
+
+
+# Read the page of posts asked for by the before/after cursor in the query string.
+def get_page(name, *params, shards=None):
+    """
+    param name: prefix of the _latest, _before and _after statements in SQL
+    param params: values for the placeholders ahead of the cursor
+    param shards: the shards holding the posts, all of them if None
+    return: a PostPage that reads the rows as it is iterated
+    raise 400: if the cursor is malformed
+    """
+    per_page = current_app.config['POSTS_PER_PAGE']
+    before = request.args.get('before')
+    after = request.args.get('after')
+
+    if after is not None:
+        # walk the index forwards from the cursor, then flip back to newest first
+        rows = list(scatter(
+            SQL[name + '_after'], (*params, *decode_cursor(after), per_page + 1),
+            post_position, limit=per_page + 1, shards=shards,
+        ))
+        g.setdefault('cache_tags', set()).update(f"post:{row['id']}" for row in rows)
+        return PostPage(rows[:per_page][::-1], per_page, len(rows) > per_page, has_next=True)
+
+    if before is not None:
+        return PostPage(scatter(
+            SQL[name + '_before'], (*params, *decode_cursor(before), per_page + 1),
+            post_position, reverse=True, limit=per_page + 1, shards=shards,
+        ), per_page, has_prev=True)
+
+    return PostPage(scatter(
+        SQL[name + '_latest'], (*params, per_page + 1),
+        post_position, reverse=True, limit=per_page + 1, shards=shards,
+    ), per_page, has_prev=False)
+
+    '''
+    With DATABASE_SHARDS set, every shard returns its own newest per_page + 1 posts from the cursor on, 
+    and scatter() merges them, so a page never needs more than per_page + 1 rows from any shard.
+    '''
+
+
+# Where blog/_article.html leaves room for the links that depend on the logged-in user.
+ACTIONS = '<!-- actions -->'
+
+
+# Render a post's <article> for the listings, split in two where the user's links go.
+def article(post):
+    def render():
+        # straight from the environment, so the template signals only time the page around it
+        html = current_app.jinja_env.get_template('blog/_article.html').render(post=post)
+        head, _, tail = html.partition(ACTIONS)
+        return Markup(head), Markup(tail)
+
+    return cached_fragment(('article', post['id'], post['version']), render, [f"post:{post['id']}"])
+
+    '''
+    The article looks the same to everyone apart from the Edit link, 
+    so it is rendered once per version of the post and the listings only fill in the link. 
+    post.version goes up with every edit and is part of the key, 
+    so no worker process serves a fragment of an older version, whichever process made the edit.
+    '''
+
+
+# Render a listing, streaming it if STREAM_TEMPLATES is set.
+def render_listing(template, **context):
+    if current_app.config['STREAM_TEMPLATES']:
+        return stream_template(template, article=article, **context)
+
+    return render_template(template, article=article, **context)
+
+
+# Show the posts, most recent first, one page at a time.
 @bp.route('/')
+@cached_page
 def index():
-    db = get_db()
-    posts = db.execute(
-        'SELECT p.id, title, body, created_at, author_id, username'
-        ' FROM post p JOIN user u ON p.author_id = u.id'
-        ' ORDER BY created_at DESC'
-    ).fetchall()
-    return render_template('blog/index.html', posts=posts)
+    posts = get_page('posts')
+
+    # the newest page also changes when a post is created
+    if not posts.has_prev:
+        g.setdefault('cache_tags', set()).add('latest')
+
+    return render_listing('blog/index.html', posts=posts)
+
+    '''
+    Keyset pagination remembers where the last page stopped instead of using OFFSET, 
+    so the query seeks straight into the post(created_at, id) index 
+    and every page costs the same no matter how many posts exist.
+    One extra row is fetched to find out whether another page follows.
+    '''
+    '''
+    cached_page serves the rendered page from memory until a post it shows changes. 
+    A new post is always the newest, so it only invalidates the page tagged 'latest'.
+    '''
+    '''
+    With STREAM_TEMPLATES set, stream_template() sends the page while it is rendered 
+    and the rows are pulled from the cursor only as the template reaches them, 
+    so the first bytes go out before the query has finished.
+    '''
+
+
+# Show one author's posts, most recent first, one page at a time.
+@bp.route('/author/<username>')
+@cached_page
+def author(username):
+    user = get_read_db().execute(SQL['user_profile'], (username,)).fetchone()
+
+    if user is None:
+        abort(404, f"User {username} doesn't exist.")
+
+    # every page shows the post count, so any new or deleted post of theirs changes it
+    g.setdefault('cache_tags', set()).add(f"author:{user['id']}")
+
+    return render_listing(
+        'blog/author.html', author=user,
+        posts=get_page('author_posts', user['id'], shards=[shard_for(user['id'])] + unbalanced_shards()),
+    )
+
+    '''
+    The pages seek into the post(author_id, created_at, id) index, 
+    and post_count is kept up to date by triggers in schema.sql, 
+    so a page costs the same however many posts the author has written.
+    '''
+
+
+# Turn free text into an FTS5 query that matches posts containing every word.
+def match_query(text):
+    return ' '.join('"{}"'.format(word.replace('"', '""')) for word in text.split())
+
+
+# Escape a snippet from the search index and turn its markers into <mark> tags.
+def highlight(text):
+    return Markup(str(escape(text)).replace('\x02', '<mark>').replace('\x03', '</mark>'))
+
+
+# Search the posts, best matches first.
+@bp.route('/search')
+def search():
+    q = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+    per_page = current_app.config['POSTS_PER_PAGE']
+    posts = []
+
+    if not 1 <= page <= current_app.config['SEARCH_MAX_PAGES']:
+        abort(400, f"Invalid page {page}.")
+
+    if q and len(read_shards()) == 1:
+        posts = get_read_db().execute(
+            SQL['post_search'], (match_query(q), per_page + 1, (page - 1) * per_page)
+        ).fetchall()
+    elif q:
+        # every shard ranks its own best matches, up to the end of this page
+        posts = list(itertools.islice(
+            scatter(SQL['post_search'], (match_query(q), page * per_page + 1, 0), lambda post: post['rank']),
+            (page - 1) * per_page, page * per_page + 1,
+        ))
+
+    return render_template(
+        'blog/search.html', q=q, page=page, highlight=highlight,
+        posts=posts[:per_page], has_next=len(posts) > per_page and page < current_app.config['SEARCH_MAX_PAGES'],
+    )
+
+    '''
+    post_fts is an FTS5 index over the post titles and bodies, kept up to date by triggers, 
+    so a search looks words up in the index instead of scanning every post with LIKE. 
+    rank orders the matches by bm25 relevance. 
+    Relevance isn't stored anywhere it could be seeked into, so the results are paged by number, 
+    and every page reads all the matches before it, from every shard when posts are sharded. 
+    SEARCH_MAX_PAGES keeps that from growing without bound.
+    highlight() and snippet() wrap the matched words in control characters; 
+    highlight escapes the text first and only then turns those into <mark> tags.
+    '''
+
+
+# Show a single post with its full body.
+@bp.route('/<int:id>')
+def detail(id):
+    return render_template('blog/detail.html', post=get_post(id, check_author=False))
 
 
 # Get a post and its author by id.
@@ -27,20 +286,50 @@ def get_post(id, check_author=True):
     raise 404: if a post with the given id doesn't exist
     raise 403: if the current user isn't the author
     """
-    post = get_db().execute(
-        'SELECT p.id, title, body, created_at, author_id, username'
-        ' FROM post p JOIN user u ON p.author_id = u.id'
-        ' WHERE p.id = ?',
-        (id,)
-    ).fetchone()
-
-    if post is None:
+    return find_post(id, check_author)[1]
+
+
+# Get a post and the shard it is on by id.
+def find_post(id, check_author=True, name='post_by_id'):
+    """
+    param id: id of post to get
+    param check_author: require the current user to be the author
+    param name: the statement in SQL to read the post with
+    return: (shard, post), the shard is None when posts aren't sharded
+    raise 404: if a post with the given id doesn't exist
+    raise 403: if the current user isn't the author
+    """
+    for shard in shards_for_post(id):
+        post = get_shard_db(shard, readonly=True).execute(SQL[name], (id,)).fetchone()
+        if post is not None:
+            break
+    else:
         abort(404, f"Post id {id} doesn't exist.")
 
     if check_author and post['author_id'] != g.user['id']:
         abort(403)
 
-    return post
+    return shard, post
+
+    '''
+    A post is normally on the shard it was created on, which its id tells, so that shard is asked first. 
+    The others are only asked when a rebalance has moved it, or when it doesn't exist, 
+    and the shards it may not have been moved from yet last.
+    '''
+
+
+# Store a new post and return its id.
+def insert_post(title, body, author_id):
+    shard = shard_for(author_id)
+    excerpt = make_excerpt(body, current_app.config['EXCERPT_LENGTH'])
+    id = write(SQL['post_insert'], (title, excerpt, body, author_id, timestamp()), shard)
+
+    if shard is not None:
+        # a separate write to the main database, if it fails rebalance-shards recounts the posts
+        write(SQL['user_add_post_count'], (1, author_id))
+
+    invalidate_pages('latest', f'author:{author_id}')
+    return id
 
 
 # Create a new post for the current user.
@@ -58,13 +347,7 @@ def create():
         if error is not None:
             flash(error)
         else:
-            db = get_db()
-            db.execute(
-                'INSERT INTO post (title, body, author_id)'
-                ' VALUES (?, ?, ?)',
-                (title, body, g.user['id'])
-            )
-            db.commit()
+            insert_post(title, body, g.user['id'])
             return redirect(url_for('blog.index'))
 
     return render_template('blog/create.html')
@@ -79,7 +362,7 @@ def create():
 @bp.route('/<int:id>/update', methods=('GET', 'POST'))
 @login_required
 def update(id):
-    post = get_post(id)
+    shard, post = find_post(id)
 
     if request.method == 'POST':
         title = request.form['title']
@@ -92,13 +375,10 @@ def update(id):
         if error is not None:
             flash(error)
         else:
-            db = get_db()
-            db.execute(
-                'UPDATE post SET title = ?, body = ?'
-                ' WHERE id = ?',
-                (title, body, id)
-            )
-            db.commit()
+            excerpt = make_excerpt(body, current_app.config['EXCERPT_LENGTH'])
+            write(SQL['post_update'], (title, excerpt, body, timestamp(), id), shard)
+            invalidate_pages(f'post:{id}')
+            invalidate_fragments(f'post:{id}')
             return redirect(url_for('blog.index'))
 
     return render_template('blog/update.html', post=post)
@@ -109,10 +389,12 @@ def update(id):
 @bp.route('/<int:id>/delete', methods=('POST',))
 @login_required
 def delete(id):
-    get_post(id)
-    db = get_db()
-    db.execute(
-        'DELETE FROM post WHERE id = ?', (id, )
-    )
-    db.commit()
+    shard, post = find_post(id)
+    write(SQL['post_delete'], (id,), shard)
+
+    if shard is not None:
+        # a separate write to the main database, if it fails rebalance-shards recounts the posts
+        write(SQL['user_add_post_count'], (-1, post['author_id']))
+
+    invalidate_pages(f'post:{id}', f"author:{post['author_id']}")
     return redirect(url_for('blog.index'))
@@ -0,0 +1,190 @@
+import csv
+import itertools
+import json
+import os
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from flaskr.blog import make_excerpt
+from flaskr.db import get_db, get_shard_db, timestamp, read_shards, shard_for
+from flaskr.queries import SQL
+
+FIELDS = ('title', 'body', 'author', 'created_at')
+
+
+# Split an iterable into lists of at most size items.
+def batched(iterable, size):
+    iterator = iter(iterable)
+
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+# Guess the file format from its name, defaulting to JSON lines.
+def guess_format(name):
+    return 'csv' if os.path.splitext(name)[1].lower() == '.csv' else 'jsonl'
+
+
+# Read posts from a JSON lines or CSV file, one (line number, dict) pair at a time.
+def read_posts(f, fmt):
+    if fmt == 'csv':
+        reader = csv.DictReader(f)
+        for post in reader:
+            yield reader.line_num, post
+    else:
+        for n, line in enumerate(f, 1):
+            if line.strip():
+                try:
+                    yield n, json.loads(line)
+                except ValueError as e:
+                    raise click.ClickException(f'line {n}: {e}')
+
+
+# Check a post read from a file, and return its title, body, author name and created_at.
+def check_post(n, post):
+    """
+    param n: the line of the file the post is on
+    param post: the post as read
+    return: (title, body, author, created_at), created_at the way it is stored
+    raise click.ClickException: if the post is malformed
+    """
+    if not isinstance(post, dict):
+        raise click.ClickException(f'line {n}: expected an object with the post fields.')
+
+    for field in ('title', 'author'):
+        if not isinstance(post.get(field), str) or not post[field]:
+            raise click.ClickException(f'line {n}: {field} is required.')
+
+    for field in ('body', 'created_at'):
+        if post.get(field) is not None and not isinstance(post[field], str):
+            raise click.ClickException(f'line {n}: {field} must be text.')
+
+    try:
+        created_at = timestamp(post.get('created_at') or None)
+    except ValueError:
+        raise click.ClickException(f"line {n}: invalid created_at {post['created_at']!r}.") from None
+
+    return post['title'], post.get('body') or '', post['author'], created_at
+
+
+# Write posts to a JSON lines or CSV file as they are produced.
+def write_posts(f, fmt, posts):
+    if fmt == 'csv':
+        writer = csv.DictWriter(f, FIELDS, lineterminator='\n')
+        writer.writeheader()
+        for post in posts:
+            writer.writerow(post)
+    else:
+        for post in posts:
+            f.write(json.dumps(post) + '\n')
+
+
+def export_posts(f, fmt):
+    """
+    param f: text file to write to
+    param fmt: 'jsonl' or 'csv'
+    return: the number of posts written
+    """
+    count = 0
+
+    def posts():
+        nonlocal count
+        for shard in read_shards():
+            for row in get_shard_db(shard, readonly=True).execute(SQL['posts_export']):
+                count += 1
+                yield {'title': row[0], 'body': row[1], 'author': row[2], 'created_at': str(row['created_at'])}
+
+    write_posts(f, fmt, posts())
+    return count
+
+
+def import_posts(posts, batch_size=1000, progress=None):
+    """
+    param posts: iterable of (line number, dict) pairs, the dicts with title, author and optionally body and created_at
+    param batch_size: number of posts inserted per transaction
+    param progress: called with the running total after every batch
+    return: the number of posts inserted
+    raise click.ClickException: if a post is malformed or names an author that doesn't exist
+    """
+    db = get_db()
+    excerpt_length = current_app.config['EXCERPT_LENGTH']
+    authors = {}
+    count = 0
+
+    def author_id(n, name):
+        if name not in authors:
+            row = db.execute(SQL['user_id_by_username'], (name,)).fetchone()
+            if row is None:
+                raise click.ClickException(f'line {n}: unknown author {name!r}.')
+            authors[name] = row[0]
+        return authors[name]
+
+    for batch in batched(posts, batch_size):
+        shards = {}
+        for n, post in batch:
+            title, body, author, created_at = check_post(n, post)
+            author = author_id(n, author)
+            shards.setdefault(shard_for(author), []).append((
+                title, make_excerpt(body, excerpt_length), body, author, created_at,
+            ))
+            count += 1
+
+        for shard, rows in shards.items():
+            shard_db = get_shard_db(shard)
+            with shard_db:
+                shard_db.executemany(SQL['posts_import'], rows)
+
+            if shard is not None:
+                # the post_count triggers only see posts in the main database
+                added = {}
+                for row in rows:
+                    added[row[3]] = added.get(row[3], 0) + 1
+                with db:
+                    db.executemany(SQL['user_add_post_count'], [(n, author) for author, n in added.items()])
+
+        if progress is not None:
+            progress(count)
+
+    return count
+
+    '''
+    Each batch is one transaction, so SQLite syncs the file once per batch instead of once per post,
+    and executemany() reuses a single prepared statement for the whole batch.
+    The posts are read, converted and inserted a batch at a time,
+    so memory use stays the same however large the file is.
+    Batches that were committed stay in the database if a later one fails, 
+    and the error names the line of the post that made it fail.
+    '''
+
+
+@click.command('export-posts')
+@click.argument('file', type=click.File('w'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(['jsonl', 'csv']), help='Defaults to the file extension.')
+@with_appcontext
+def export_posts_command(file, fmt):
+    # Write every post to a JSON lines or CSV file, or to stdout.
+    count = export_posts(file, fmt or guess_format(file.name))
+    click.echo(f'Exported {count} posts', err=True)
+
+
+@click.command('import-posts')
+@click.argument('file', type=click.File('r'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(['jsonl', 'csv']), help='Defaults to the file extension.')
+@click.option('--batch-size', default=1000, show_default=True, help='Posts inserted per transaction.')
+@with_appcontext
+def import_posts_command(file, fmt, batch_size):
+    # Load posts from a JSON lines or CSV file, or from stdin.
+    posts = read_posts(file, fmt or guess_format(file.name))
+    count = import_posts(posts, batch_size, lambda n: click.echo(f'{n} posts imported', err=True))
+    click.echo(f'Imported {count} posts', err=True)
+
+
+def init_app(app):
+    # Register the import and export commands with the Flask app.
+    app.cli.add_command(export_posts_command)
+    app.cli.add_command(import_posts_command)
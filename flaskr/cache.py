@@ -0,0 +1,208 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, request, session, make_response
+
+from flaskr.db import post_changes
+
+
+# A bounded least-recently-used cache whose entries expire after a timeout.
+class LRUCache(object):
+    def __init__(self, max_size=128, timeout=60):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # when each tag was last invalidated, counted in invalidations
+        self._generation = 0
+        self._invalidated = OrderedDict()
+        self._forgotten = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def generation(self):
+        # A mark to pass to set() as since, taken before reading what the value is made from.
+        return self._generation
+
+    def set(self, key, value, tags=(), since=None):
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            if since is not None and self._stale(tags, since):
+                return
+
+            self._entries[key] = (time.monotonic() + self.timeout, value, frozenset(tags))
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *tags):
+        # Drop every entry that was stored with one of the given tags.
+        tags = set(tags)
+
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if e[2] & tags]:
+                del self._entries[key]
+
+            self._generation += 1
+            for tag in tags:
+                self._invalidated[tag] = self._generation
+                self._invalidated.move_to_end(tag)
+
+            while len(self._invalidated) > max(self.max_size, 1024):
+                # values older than a forgotten invalidation can't be checked any more, see _stale
+                self._forgotten = self._invalidated.popitem(last=False)[1]
+
+    def _stale(self, tags, since):
+        # Tell whether a value read at generation `since` may miss an invalidation of one of its tags.
+        if since < self._forgotten:
+            return True
+
+        return any(self._invalidated.get(tag, 0) > since for tag in tags)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    '''
+    OrderedDict keeps the entries in the order they were last used,
+    so the least recently used entry is always the first one and can be evicted with popitem(last=False).
+    Tags let a writer throw away exactly the entries that depend on what it changed
+    instead of clearing the whole cache.
+    A value is made from data read before set() is called, and a writer may invalidate its tags in between, 
+    so set() drops values made before the last invalidation of one of their tags.
+    '''
+
+
+def get_page_cache(app):
+    cache = app.extensions.get('flaskr.page_cache')
+
+    if cache is None:
+        cache = app.extensions['flaskr.page_cache'] = LRUCache(
+            max_size=app.config['PAGE_CACHE_SIZE'],
+            timeout=app.config['PAGE_CACHE_TIMEOUT'],
+        )
+
+    return cache
+
+
+# Invalidate every cached page stored with one of the given tags.
+def invalidate_pages(*tags):
+    get_page_cache(current_app).invalidate(*tags)
+
+
+def get_fragment_cache(app):
+    cache = app.extensions.get('flaskr.fragment_cache')
+
+    if cache is None:
+        cache = app.extensions['flaskr.fragment_cache'] = LRUCache(
+            max_size=app.config['FRAGMENT_CACHE_SIZE'],
+            timeout=app.config['FRAGMENT_CACHE_TIMEOUT'],
+        )
+
+    return cache
+
+
+# Return the fragment cached under key, rendering and storing it first if it isn't there.
+def cached_fragment(key, render, tags=()):
+    cache = get_fragment_cache(current_app)
+    fragment = cache.get(key)
+
+    if fragment is None:
+        fragment = render()
+        cache.set(key, fragment, tags)
+
+    return fragment
+
+
+# Invalidate every cached fragment stored with one of the given tags.
+def invalidate_fragments(*tags):
+    get_fragment_cache(current_app).invalidate(*tags)
+
+
+# View decorator that serves a whole rendered page from the page cache.
+def cached_page(view):
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        # pages with pending flash messages are rendered once for that user only
+        if request.method != 'GET' or session.get('_flashes'):
+            return view(**kwargs)
+
+        cache = get_page_cache(current_app)
+        # every cached page lists posts, read before the page is so a write meanwhile changes the key
+        key = (request.full_path, g.user['id'] if g.user else None, post_changes())
+        body = cache.get(key)
+
+        if body is not None:
+            response = make_response(body)
+            response.headers['X-Cache'] = 'HIT'
+            return response
+
+        g.cache_tags = set()
+        since = cache.generation()
+        response = make_response(view(**kwargs))
+
+        if response.status_code == 200:
+            if response.is_streamed:
+                response.response = _store_when_done(response.response, cache, key, g.cache_tags, since)
+            else:
+                cache.set(key, response.get_data(as_text=True), g.cache_tags, since)
+        response.headers['X-Cache'] = 'MISS'
+        return response
+
+    return wrapped_view
+
+    '''
+    The cache key is the path with its query string plus the id of the logged-in user,
+    because the navigation and the Edit links differ between users.
+    While rendering, the view adds tags to g.cache_tags describing what the page depends on,
+    and the writers call invalidate_pages() with the same tags after changing the database.
+    A streamed page is stored once the last chunk has been sent.
+    A page is not stored if one of its tags was invalidated while it was being rendered, 
+    since it may show what was there before.
+    Every process has a cache of its own, and invalidate_pages() only reaches the cache of the process that wrote, 
+    so the key also holds the post_changes counters, which triggers raise with every write to a post. 
+    A page changed by another worker under flask serve is then looked up under a new key and rendered again, 
+    at the cost of one lookup per shard on every request, hit or miss; 
+    the entries under the old key are never asked for again and drop out of the LRU.
+    '''
+
+
+# Pass a streamed body through, and store it in the cache once it has been sent completely.
+def _store_when_done(body, cache, key, tags, since):
+    chunks = []
+
+    try:
+        for chunk in body:
+            chunks.append(chunk if isinstance(chunk, str) else chunk.decode())
+            yield chunk
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+
+    cache.set(key, ''.join(chunks), tags, since)
@@ -0,0 +1,19 @@
+-- counts the writes to the post table, so a page cached by any process can tell that it is out of date
+CREATE TABLE IF NOT EXISTS post_changes (
+    id INTEGER PRIMARY KEY,
+    changes INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO post_changes (id, changes) VALUES (1, 0);
+
+CREATE TRIGGER IF NOT EXISTS post_changes_insert AFTER INSERT ON post BEGIN
+    UPDATE post_changes SET changes = changes + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_changes_update AFTER UPDATE ON post BEGIN
+    UPDATE post_changes SET changes = changes + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_changes_delete AFTER DELETE ON post BEGIN
+    UPDATE post_changes SET changes = changes + 1 WHERE id = 1;
+END;
@@ -0,0 +1,106 @@
+import gzip
+import zlib
+
+from flask import current_app, request, g
+
+from flaskr.assets import COMPRESSIBLE
+
+
+def should_compress(response):
+    """
+    param response: the response about to be sent
+    return: whether its body is a kind worth compressing and isn't compressed yet
+    """
+    return (
+        200 <= response.status_code < 300
+        and response.status_code not in (204, 206)
+        and not response.direct_passthrough
+        and 'Content-Encoding' not in response.headers
+        and response.mimetype.startswith(COMPRESSIBLE)
+    )
+
+
+# Compress each chunk of a streamed body as it is produced.
+def gzip_stream(body, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    try:
+        for chunk in body:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+
+    '''
+    Z_SYNC_FLUSH pushes out everything compressed so far at the end of each chunk,
+    so the browser can start on the top of the page while the rest is still being rendered,
+    at the cost of compressing a little worse than one pass over the whole body.
+    wbits=31 makes zlib write the gzip header and trailer instead of the zlib ones.
+    '''
+
+
+# Let a client send back the ETag of a compressed response to revalidate it.
+def accept_gzip_etags():
+    value = request.environ.get('HTTP_IF_NONE_MATCH')
+
+    if value and '-gzip"' in value:
+        # the views compare against the ETag of the uncompressed body
+        request.environ['HTTP_IF_NONE_MATCH'] = value.replace('-gzip"', '"')
+        g.gzip_etag = True
+
+
+# Gzip the response if the client accepts it and it is big enough to be worth the CPU.
+def compress_response(response):
+    if response.status_code == 304 and g.get('gzip_etag') and response.headers.get('ETag'):
+        # answer with the same ETag the client has
+        etag, weak = response.get_etag()
+        response.set_etag(etag + '-gzip', weak)
+        return response
+
+    if not should_compress(response):
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    if 'gzip' not in request.accept_encodings:
+        return response
+
+    level = current_app.config['COMPRESS_LEVEL']
+
+    if response.is_streamed:
+        response.response = gzip_stream(response.response, level)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+            return response
+        response.set_data(gzip.compress(data, level, mtime=0))
+
+    response.headers['Content-Encoding'] = 'gzip'
+
+    if response.headers.get('ETag'):
+        etag, weak = response.get_etag()
+        response.set_etag(etag + '-gzip', weak)
+
+    return response
+
+    '''
+    The size of a streamed body isn't known until it has been sent, so streamed responses are always compressed.
+    Responses that already have a Content-Encoding, like the precompressed static files,
+    and types that don't shrink, like images, are sent as they are.
+    The compressed body gets its own ETag, since it is a different sequence of bytes than the uncompressed one. 
+    accept_gzip_etags takes the suffix off again when the client sends it back in If-None-Match, 
+    so make_conditional() can compare it with the uncompressed ETag and answer 304.
+    '''
+
+
+def init_app(app):
+    # Compress dynamic responses, if COMPRESS is set. This is called by the application factory.
+    if app.config['COMPRESS']:
+        app.before_request(accept_gzip_etags)
+        app.after_request(compress_response)
@@ -1,16 +1,523 @@
+import functools
+import heapq
+import itertools
+import os
+import re
+import pathlib
+import queue
 import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from datetime import datetime, timedelta, timezone
+from operator import itemgetter
 
 import click
-from flask import g, current_app
+from flask import g, current_app, has_app_context
+from flask.cli import with_appcontext
+
+from flaskr.queries import SQL, STATEMENT_CACHE_SIZE
+
+
+# A cursor that adds its statements, and the time they took to run, to the queries of the current request.
+class CountedCursor(sqlite3.Cursor):
+    _query = None
+
+    def _record(self, sql):
+        self._query = [sql, 0.0, 0]
+        if has_app_context():
+            g.setdefault('queries', []).append(self._query)
+
+    def _timed(self, fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            if self._query is not None:
+                self._query[1] += time.perf_counter() - started
+
+    def execute(self, sql, params=()):
+        self._record(sql)
+        self._timed(super().execute, sql, params)
+        self._query[2] += max(self.rowcount, 0)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self._record(sql)
+        self._timed(super().executemany, sql, seq_of_params)
+        self._query[2] += max(self.rowcount, 0)
+        return self
+
+    def executescript(self, sql_script):
+        self._record(sql_script)
+        self._timed(super().executescript, sql_script)
+        return self
+
+    '''
+    Each statement is recorded as [sql, seconds, rows] on g.queries. 
+    Only execute() is timed here, which runs a query up to its first row, 
+    and rows only counts the rows a write changed, so reading the rows costs nothing extra. 
+    The pool's own pragmas and health checks use a plain sqlite3.Cursor, so they aren't counted.
+    '''
+
+
+# A cursor that also times reading the rows of its statements, and counts them.
+class TimedCursor(CountedCursor):
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is not None and self._query is not None:
+            self._query[2] += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(super().fetchmany, self.arraysize if size is None else size)
+        if self._query is not None:
+            self._query[2] += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        if self._query is not None:
+            self._query[2] += len(rows)
+        return rows
+
+    def __next__(self):
+        row = self._timed(super().__next__)
+        self._query[2] += 1
+        return row
+
+    '''
+    Rows may be read long after execute() returned, e.g. while a template is streamed, 
+    so the fetches add their time and rows to the same record. 
+    fetchone() and friends don't go through __next__ in C, which is why each of them is wrapped, 
+    and that Python call for every row is why QUERY_TIMING is off by default.
+    '''
+
+
+# A connection whose statements are counted.
+class CountedConnection(sqlite3.Connection):
+    cursor_factory = CountedCursor
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or self.cursor_factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+# A connection whose statements are timed row by row.
+class TimedConnection(CountedConnection):
+    cursor_factory = TimedCursor
+
+
+# The oldest SQLite with everything flaskr uses: UPDATE ... RETURNING for the job queue, and ALTER TABLE DROP COLUMN.
+SQLITE_MIN_VERSION = (3, 35, 0)
+
+# Each shard numbers its posts from (shard + 1) << SHARD_ID_BITS, so post ids are unique across shards.
+SHARD_ID_BITS = 40
+
+# Columns that hold timestamps, converted to datetime when they are read by name.
+TIMESTAMPS = frozenset(['created_at', 'updated_at'])
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_datetime(value):
+    """
+    param value: a stored timestamp, either UTC text like '2023-01-01 00:00:00' or epoch seconds
+    return: the timestamp as a naive UTC datetime
+    """
+    if isinstance(value, (int, float)):
+        return EPOCH + timedelta(seconds=value)
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def timestamp(value=None):
+    """
+    param value: a datetime, UTC text or epoch seconds, or None for now
+    return: the value the way created_at is stored, epoch seconds if EPOCH_TIMESTAMPS is set and UTC text otherwise
+    """
+    value = datetime.now(timezone.utc).replace(tzinfo=None) if value is None else to_datetime(value)
+
+    if current_app.config['EPOCH_TIMESTAMPS']:
+        return int((value - EPOCH).total_seconds())
+
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+
+# A row of a query result, as a plain tuple that can also be indexed by column name.
+class Record(tuple):
+    __slots__ = ()
+    _fields = ()
+    _index = {}
+
+    def __getitem__(self, key):
+        if key.__class__ is not str:
+            return tuple.__getitem__(self, key)
+
+        try:
+            value = tuple.__getitem__(self, self._index[key])
+        except KeyError:
+            raise IndexError(f'No item with that key: {key!r}') from None
+
+        if key in TIMESTAMPS and value is not None:
+            return to_datetime(value)
+        return value
+
+    def raw(self, key):
+        # the column as it is stored, without converting timestamps
+        return tuple.__getitem__(self, self._index[key])
+
+    def keys(self):
+        return list(self._fields)
+
+    def __repr__(self):
+        return f'<Record {dict(zip(self._fields, tuple(self)))}>'
+
+
+_record_types = {}
+_last_record_type = (None, None)
+
+
+# Row factory that turns each row into a Record of the columns of its statement.
+def record_factory(cursor, row):
+    global _last_record_type
+    description = cursor.description
+    last = _last_record_type
+
+    if last[0] is not description:
+        fields = tuple(map(itemgetter(0), description))
+        record_type = _record_types.get(fields)
+        if record_type is None:
+            record_type = _record_types[fields] = type('Record', (Record,), {
+                '__slots__': (),
+                '_fields': fields,
+                '_index': {name: n for n, name in enumerate(fields)},
+            })
+        last = _last_record_type = (description, record_type)
+
+    return last[1](row)
+
+    '''
+    sqlite3.Row keeps a reference to the row tuple and the cursor description in a second object,
+    while a Record is the row tuple itself, so each row is one allocation less.
+    Every statement shape gets its own Record subclass with a name to position map,
+    made once and then looked up again only when the cursor changes, not for every row.
+    detect_types would parse every timestamp into a datetime as its row is read,
+    instead they are only parsed when a view or template asks for one by name,
+    and record.raw() gives the stored value, e.g. for page cursors that are compared with the index.
+    '''
+
+
+# A small pool of open SQLite connections, shared by the requests of one worker process.
+class ConnectionPool(object):
+    def __init__(self, database, max_size=5, pragmas=(), readonly=False, factory=sqlite3.Connection, attach=None):
+        self.database = database
+        self.max_size = max_size
+        self.pragmas = list(pragmas)
+        self.readonly = readonly
+        self.factory = factory
+        self.attach = attach
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+
+    def connect(self):
+        uri = pathlib.Path(os.path.abspath(self.database)).as_uri()
+        db = sqlite3.connect(
+            # SQLite itself refuses to write through a connection opened with mode=ro
+            uri + '?mode=ro' if self.readonly else uri,
+            check_same_thread=False,
+            uri=True,
+            factory=self.factory,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        for name, value in self.pragmas:
+            db.cursor(sqlite3.Cursor).execute(f'PRAGMA {name} = {value}')
+        if self.attach:
+            # a shard's posts are joined with the users in the main database, which it never writes to
+            attach = pathlib.Path(os.path.abspath(self.attach)).as_uri() + '?mode=ro'
+            db.cursor(sqlite3.Cursor).execute('ATTACH DATABASE ? AS users', (attach,))
+        return db
+
+    def acquire(self):
+        if self._pid != os.getpid():
+            # connections must not cross a fork, start over with a fresh pool
+            self._pid = os.getpid()
+            self._idle = queue.LifoQueue()
+
+        while True:
+            try:
+                db = self._idle.get_nowait()
+            except queue.Empty:
+                db = self.connect()
+                break
+
+            try:
+                # reset anything the last request left behind, and make sure the connection still works
+                if db.in_transaction:
+                    db.rollback()
+                db.cursor(sqlite3.Cursor).execute('SELECT 1')
+            except sqlite3.Error:
+                db.close()
+            else:
+                break
+
+        db.row_factory = record_factory
+        return db
+
+    def release(self, db):
+        if self._pid == os.getpid() and self._idle.qsize() < self.max_size:
+            try:
+                # a view that failed half way may have left a transaction open, which holds the write lock
+                if db.in_transaction:
+                    db.rollback()
+            except sqlite3.Error:
+                db.close()
+            else:
+                self._idle.put(db)
+        else:
+            db.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    '''
+    Opening a connection means opening the file, parsing the schema and warming the page cache again. 
+    The pool keeps up to max_size idle connections per process and hands them out most recently used first, 
+    so a request normally gets a connection whose cache is already warm. 
+    Connections are created with check_same_thread=False because the request that returns a connection 
+    may run on a different thread from the one that takes it next; a connection is only ever used by one request at a time.
+    '''
+
+
+def shard_path(app, shard):
+    root, ext = os.path.splitext(app.config['DATABASE'])
+    return f'{root}.shard{shard}{ext}'
+
+
+def get_pool(app, readonly=False, shard=None):
+    key = 'flaskr.db' + ('' if shard is None else f'.shard{shard}') + ('.read' if readonly else '')
+    pool = app.extensions.get(key)
+
+    if pool is None:
+        pragmas = [
+            ('cache_size', int(app.config['DATABASE_CACHE_SIZE'])),
+            ('mmap_size', int(app.config['DATABASE_MMAP_SIZE'])),
+            ('busy_timeout', int(app.config['DATABASE_BUSY_TIMEOUT'])),
+        ]
+        if readonly:
+            pragmas.append(('query_only', 1))
+        else:
+            pragmas[:0] = [('journal_mode', 'WAL'), ('synchronous', 'NORMAL')]
+
+        pool = app.extensions[key] = ConnectionPool(
+            app.config['DATABASE'] if shard is None else shard_path(app, shard),
+            max_size=app.config['DATABASE_POOL_SIZE'],
+            pragmas=pragmas,
+            readonly=readonly,
+            factory=TimedConnection if app.config['QUERY_TIMING'] else CountedConnection,
+            attach=None if shard is None else app.config['DATABASE'],
+        )
+
+    return pool
+
+
+def close_pool(app):
+    # Close every idle connection and stop the job threads and writers, e.g. before removing the database file.
+    runner = app.extensions.pop('flaskr.jobs', None)
+    if runner is not None:
+        runner.close()
+
+    for key in [key for key in app.extensions if key.startswith('flaskr.writer')]:
+        app.extensions.pop(key).close()
+
+    for key in [key for key in app.extensions if key.startswith('flaskr.db')]:
+        app.extensions.pop(key).close()
+
+
+# Runs the writes of one worker process on a single connection, committing them in groups.
+class WriteCoordinator(object):
+    def __init__(self, connect, max_batch=64, window=0.001, timeout=30):
+        self.connect = connect
+        self.max_batch = max_batch
+        self.window = window
+        self.timeout = timeout
+        self.writes = 0
+        self.groups = 0
+        self._pid = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, sql, params=()):
+        # Return the lastrowid and rowcount of the statement once its group is committed.
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # the writer thread doesn't survive a fork, start one in this process,
+                    # connecting first so a database that can't be opened fails this write and not the thread
+                    db = self.connect()
+                    self._queue = queue.Queue()
+                    self._thread = threading.Thread(
+                        target=self._run, args=(db, self._queue), name='flaskr-writer', daemon=True,
+                    )
+                    self._thread.start()
+                    self._pid = os.getpid()
+
+        future = Future()
+        self._queue.put((sql, params, future))
+
+        try:
+            return future.result(self.timeout)
+        except FutureTimeoutError:
+            # the write may still be committed later, but the request can't wait any longer for it
+            raise sqlite3.OperationalError(f'The writer did not answer within {self.timeout} seconds.') from None
+
+    def close(self):
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.put(None)
+            self._thread.join()
+        self._thread = None
+        self._pid = None
+
+    def _run(self, db, jobs):
+        db.isolation_level = None
+
+        try:
+            while True:
+                job = jobs.get()
+                if job is None:
+                    return
+
+                group = [job]
+                deadline = time.monotonic() + self.window
+                while len(group) < self.max_batch:
+                    try:
+                        job = jobs.get(timeout=max(deadline - time.monotonic(), 0))
+                    except queue.Empty:
+                        break
+                    if job is None:
+                        jobs.put(None)
+                        break
+                    group.append(job)
+
+                self._commit(db, group)
+        finally:
+            db.close()
+
+            with self._lock:
+                if self._queue is jobs and self._pid == os.getpid():
+                    # the thread died, let the next write start a new one
+                    self._pid = None
+
+            # nothing will answer the writes still queued, fail them instead of leaving their requests waiting
+            while True:
+                try:
+                    job = jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is not None:
+                    job[2].set_exception(sqlite3.OperationalError('The writer has stopped.'))
+
+    def _commit(self, db, group):
+        results = []
+
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            for sql, params, future in group:
+                # a savepoint per write, so a failing write doesn't undo the others
+                db.execute('SAVEPOINT write')
+                try:
+                    cursor = db.execute(sql, params)
+                except sqlite3.Error as e:
+                    db.execute('ROLLBACK TO write')
+                    # the traceback would keep the failed cursor and its statement alive in the caller
+                    results.append((future, None, e.with_traceback(None)))
+                else:
+                    results.append((future, (cursor.lastrowid, cursor.rowcount), None))
+                db.execute('RELEASE write')
+            db.execute('COMMIT')
+        except Exception as e:
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+            results = [(future, None, e) for sql, params, future in group]
+
+        self.writes += len(group)
+        self.groups += 1
+        for future, value, error in results:
+            if error is None:
+                future.set_result(value)
+            else:
+                future.set_exception(error)
+
+    '''
+    SQLite allows one writer at a time, and every commit waits for the file to be synced. 
+    Instead of each request taking the write lock and committing on its own, 
+    requests put their statement on a queue and wait for the result. 
+    The writer thread takes everything that arrives within `window` seconds, up to max_batch writes, 
+    runs them in one transaction and commits once. 
+    Each write gets back its own lastrowid and rowcount or exception, e.g. IntegrityError for a taken username.
+    A request waits at most `timeout` seconds for its group, and if the thread stops, the writes still queued fail,
+    so a stuck or dead writer turns into errors instead of requests that never return.
+    '''
+
+
+def get_writer(app, shard=None):
+    key = 'flaskr.writer' if shard is None else f'flaskr.writer.shard{shard}'
+    writer = app.extensions.get(key)
+
+    if writer is None:
+        pool = get_pool(app, shard=shard)
+        writer = app.extensions[key] = WriteCoordinator(
+            pool.connect,
+            max_batch=app.config['WRITE_GROUP_SIZE'],
+            window=app.config['WRITE_GROUP_WINDOW'],
+            timeout=app.config['WRITE_TIMEOUT'],
+        )
+
+    return writer
+
+
+def write(sql, params=(), shard=None):
+    """
+    param sql: a single INSERT, UPDATE or DELETE statement
+    param params: values for the ? placeholders
+    param shard: the post shard to write to, see shard_for, or None for the main database
+    return: lastrowid of the statement
+    raise sqlite3.Error: if the statement failed, e.g. IntegrityError
+    """
+    if current_app.config['WRITE_GROUP_SIZE'] <= 1:
+        db = get_shard_db(shard)
+        cursor = db.execute(sql, params)
+        db.commit()
+        return cursor.lastrowid
+
+    # the writer's connection isn't timed per request, so time the wait for it here
+    query = [sql, 0.0, 0]
+    g.setdefault('queries', []).append(query)
+    started = time.perf_counter()
+    try:
+        lastrowid, query[2] = get_writer(current_app, shard).submit(sql, params)
+    finally:
+        query[1] = time.perf_counter() - started
+
+    return lastrowid
 
 
 def get_db():
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        g.db = get_pool(current_app).acquire()
 
     return g.db
 
@@ -18,7 +525,7 @@ def get_db():
     g 
     is a special object that is unique for each request. 
     It is used to store data that might be accessed by multiple functions during the request. 
-    The connection is stored and reused instead of creating a new connection 
+    The connection is stored and reused instead of taking another one from the pool 
     if get_db is called a second time in the same request.
     '''
     '''
@@ -28,26 +535,151 @@ def get_db():
     get_db will be called when the application has been created and is handling a request, so current_app can be used.
     '''
     '''
-    sqlite3.connect() establishes a connection to the file pointed at by the DATABASE configuration key. 
-    This file doesn’t have to exist yet, and won’t until you initialize the database later.
+    The pool opens the file pointed at by the DATABASE configuration key with sqlite3.connect(). 
+    This file doesn’t have to exist yet, and won’t until you initialize the database later. 
+    Every new connection switches to WAL journaling with synchronous=NORMAL 
+    and applies the DATABASE_CACHE_SIZE, DATABASE_MMAP_SIZE and DATABASE_BUSY_TIMEOUT settings once.
     '''
     '''
-    sqlite3.Row 
+    record_factory 
     tells the connection to return rows that behave like dicts. 
     This allows accessing the columns by name.
     '''
 
 
+# Get a read-only connection for views that only query the database.
+def get_read_db():
+    if 'read_db' not in g:
+        g.read_db = get_pool(current_app, readonly=True).acquire()
+
+    return g.read_db
+
+    '''
+    Read-only connections come from their own pool. 
+    They are opened with mode=ro and query_only, so a view can't take the write lock by accident, 
+    and under WAL a reader never waits for the writer nor holds it up. 
+    Changes go through write() instead.
+    '''
+
+
+# The post shards, or [None] when all posts are in the main database.
+def post_shards():
+    shards = current_app.config['DATABASE_SHARDS']
+    return list(range(shards)) if shards > 1 else [None]
+
+
+# The shard that holds an author's posts.
+def shard_for(author_id):
+    shards = current_app.config['DATABASE_SHARDS']
+    return author_id % shards if shards > 1 else None
+
+
+# The ids a shard gives to the posts created on it start after this one, 0 for the main database.
+def shard_id_start(shard):
+    return 0 if shard is None else (shard + 1) << SHARD_ID_BITS
+
+
+# The shards outside DATABASE_SHARDS that still hold posts, because rebalance-shards hasn't moved them yet.
+def unbalanced_shards():
+    app = current_app._get_current_object()
+    cached = app.extensions.get('flaskr.shards.unbalanced')
+
+    if cached is None or cached[0] != app.config['DATABASE_SHARDS']:
+        current = post_shards()
+        candidates = ([] if current == [None] else [None]) + [shard for shard in stored_shards() if shard not in current]
+        cached = app.extensions['flaskr.shards.unbalanced'] = (app.config['DATABASE_SHARDS'], [
+            shard for shard in candidates
+            if get_shard_db(shard, readonly=True).execute(SQL['post_max_id']).fetchone()[0] is not None
+        ])
+
+    return cached[1]
+
+    '''
+    That is the main database right after sharding was turned on, and the shards that were dropped by lowering DATABASE_SHARDS. 
+    The answer is kept for the life of the process: new posts only go to the shards in DATABASE_SHARDS, 
+    so one that was empty stays empty, and one that rebalance-shards empties later only costs an index lookup that finds nothing.
+    '''
+
+
+# The shards to read posts from, those in DATABASE_SHARDS first.
+def read_shards():
+    return post_shards() + unbalanced_shards()
+
+
+# A value that changes with every write to a post, on any shard and from any process.
+def post_changes():
+    return tuple(get_shard_db(shard, readonly=True).execute(SQL['post_changes']).fetchone()[0] for shard in read_shards())
+
+
+# The shards to look for a post in, the one it was created on first.
+def shards_for_post(id):
+    shards = read_shards()
+    home = (id >> SHARD_ID_BITS) - 1
+
+    if home in shards:
+        shards.remove(home)
+        shards.insert(0, home)
+
+    return shards
+
+
+# Get a connection to one post shard for the rest of the request.
+def get_shard_db(shard, readonly=False):
+    if shard is None:
+        return get_read_db() if readonly else get_db()
+
+    dbs = g.setdefault('shard_dbs', {})
+
+    if (shard, readonly) not in dbs:
+        dbs[shard, readonly] = get_pool(current_app, readonly, shard).acquire()
+
+    return dbs[shard, readonly]
+
+
+def scatter(sql, params, key, reverse=False, limit=None, shards=None):
+    """
+    param sql: statement whose results are ordered by key
+    param params: values for its placeholders, the same on every shard
+    param key: function giving the sort key of a row
+    param reverse: whether the results are ordered from the largest key down
+    param limit: number of rows to return at most
+    param shards: the shards to ask, all of them if None
+    return: an iterator over the rows of every shard, merged in order
+    """
+    shards = read_shards() if shards is None else shards
+    cursors = [get_shard_db(shard, readonly=True).execute(sql, params) for shard in shards]
+
+    if len(cursors) == 1:
+        return cursors[0]
+
+    return itertools.islice(heapq.merge(*cursors, key=key, reverse=reverse), limit)
+
+    '''
+    Every shard returns its rows already in order from its own index, 
+    so heapq.merge only has to compare the heads of the cursors to pick the next row, 
+    and stops reading each shard once `limit` rows have been returned.
+    '''
+
+
 def close_db(e=None):
     db = g.pop('db', None)
 
     if db is not None:
-        db.close()
+        get_pool(current_app).release(db)
+
+    read_db = g.pop('read_db', None)
+
+    if read_db is not None:
+        get_pool(current_app, readonly=True).release(read_db)
+
+    for (shard, readonly), db in g.pop('shard_dbs', {}).items():
+        get_pool(current_app, readonly, shard).release(db)
 
     '''
     close_db 
-    checks if a connection was created by checking if g.db was set. 
-    If the connection exists, it is closed. 
+    checks if a connection was taken by checking if g.db or g.read_db was set. 
+    If the connection exists, it is given back to the pool, 
+    which keeps it open for the next request or closes it if enough connections are idle already. 
     Further down you will tell your application about the close_db function 
     in the application factory so that it is called after each request.
     '''
@@ -59,12 +691,154 @@ def init_db():
     with current_app.open_resource('schema.sql') as f:
         db.executescript(f.read().decode('utf8'))
 
+    with current_app.open_resource('search.sql') as f:
+        db.executescript(f.read().decode('utf8'))
+
+    with current_app.open_resource('changes.sql') as f:
+        db.executescript(f.read().decode('utf8'))
+
+    # schema.sql is the latest version, there is nothing to upgrade
+    from flaskr.migrations import MIGRATIONS
+    db.execute(f'PRAGMA user_version = {len(MIGRATIONS)}')
+
+    for shard in post_shards():
+        if shard is not None:
+            init_shard(shard)
+    current_app.extensions.pop('flaskr.shards.unbalanced', None)
+
     '''
     open_resource() 
     opens a file relative to the flaskr package, 
     which is useful since you won’t necessarily know where that location is when deploying the application later. 
     get_db returns a database connection, which is used to execute the commands read from the file.
     '''
+    '''
+    search.sql creates the post_fts full-text index and the triggers that keep it in step with the post table. 
+    It only uses IF NOT EXISTS, so rebuild_search_index can run it against an existing database as well.
+    changes.sql keeps its counter when the post table is created again, so a page cached before never looks current.
+    '''
+
+
+# Create the post tables of a shard, dropping any that are there.
+def init_shard(shard):
+    db = get_shard_db(shard)
+
+    with current_app.open_resource('shard.sql') as f:
+        db.executescript(f.read().decode('utf8'))
+
+    with current_app.open_resource('search.sql') as f:
+        db.executescript(f.read().decode('utf8'))
+
+    with current_app.open_resource('changes.sql') as f:
+        db.executescript(f.read().decode('utf8'))
+
+    with db:
+        db.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('post', ?)", (shard_id_start(shard),))
+
+    '''
+    Shards don't have a user table of their own, the main database is attached to every shard connection, 
+    so the same SQL that joins posts with users works on a shard. 
+    The post_count triggers can't reach into an attached database, 
+    so on shards the views keep the counts up to date themselves.
+    '''
+
+
+# Create a shard's tables if its file doesn't have them yet, e.g. right after DATABASE_SHARDS was raised.
+def ensure_shard(shard):
+    """
+    param shard: the shard to check
+    return: True if its tables were created now
+    """
+    if get_shard_db(shard).execute(
+        "SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = 'post'"
+    ).fetchone() is not None:
+        return False
+
+    init_shard(shard)
+    return True
+
+
+def rebuild_search_index():
+    for shard in read_shards():
+        db = get_shard_db(shard)
+
+        with current_app.open_resource('search.sql') as f:
+            db.executescript(f.read().decode('utf8'))
+
+        db.execute(SQL['search_rebuild'])
+        db.commit()
+
+
+def backfill(select, update, values, batch_size=1000, pause=0.0):
+    """
+    param select: SELECT of the rows to change, ordered by their integer key, 
+        with placeholders for the last key done and the batch size
+    param update: statement that changes one row
+    param values: turns a selected row into the parameters of update
+    param batch_size: rows changed per transaction
+    param pause: seconds to wait between transactions
+    return: the number of rows changed
+    """
+    db = get_db()
+    last = 0
+    count = 0
+
+    while True:
+        with db:
+            db.execute('BEGIN IMMEDIATE')
+            rows = db.execute(select, (last, batch_size)).fetchall()
+            db.executemany(update, [values(row) for row in rows])
+
+        if not rows:
+            return count
+
+        last = rows[-1][0]
+        count += len(rows)
+        time.sleep(pause)
+
+    '''
+    Each batch is read and written inside one short write transaction, 
+    so a row can't change between reading it and writing what was computed from it, 
+    and the requests' writes get the lock between batches instead of waiting for the whole table.
+    '''
+
+
+def upgrade_db(target=None, batch_size=1000, pause=0.0, progress=None):
+    """
+    param target: version to upgrade to, the latest if None
+    param batch_size: rows backfilled per transaction
+    param pause: seconds to wait between backfill transactions
+    param progress: called with the version and name of each migration before it runs
+    return: the version the database is at now
+    raise click.ClickException: if the database is newer than this code
+    """
+    from flaskr.migrations import MIGRATIONS
+
+    db = get_db()
+    version = db.execute('PRAGMA user_version').fetchone()[0]
+    target = len(MIGRATIONS) if target is None else target
+
+    if version > len(MIGRATIONS):
+        raise click.ClickException(f'The database is at version {version}, newer than this code knows about.')
+
+    fill = functools.partial(backfill, batch_size=batch_size, pause=pause)
+
+    for n in range(version, target):
+        migration = MIGRATIONS[n]
+        if progress is not None:
+            progress(n + 1, migration.__name__)
+        migration(db, fill)
+        db.execute(f'PRAGMA user_version = {n + 1}')
+        version = n + 1
+
+    return version
+
+    '''
+    PRAGMA user_version is an integer SQLite keeps in the database header for the application, 
+    here the number of migrations applied so far. 
+    It is only raised once a migration has finished, 
+    so if an upgrade stops half way the same migration runs again next time, and its steps skip what is done.
+    '''
 
 
 @click.command('init-db')
@@ -81,10 +855,173 @@ def init_db_command():
     '''
 
 
+# Store every post's created_at the way EPOCH_TIMESTAMPS asks for.
+def convert_timestamps():
+    sql = SQL['timestamps_to_epoch'] if current_app.config['EPOCH_TIMESTAMPS'] else SQL['timestamps_to_text']
+    count = 0
+
+    for shard in read_shards():
+        db = get_shard_db(shard)
+        with db:
+            count += db.execute(sql).rowcount
+
+    return count
+
+    '''
+    Integers sort before any text in SQLite, so a database with both kinds of created_at
+    would list the posts of one kind after all posts of the other.
+    '''
+
+
+# The shard numbers that have a file, whether or not DATABASE_SHARDS still uses them.
+def stored_shards():
+    root, ext = os.path.splitext(current_app.config['DATABASE'])
+    pattern = re.compile(re.escape(os.path.basename(root)) + r'\.shard(\d+)' + re.escape(ext) + '$')
+    shards = []
+
+    for name in os.listdir(os.path.dirname(os.path.abspath(root))):
+        match = pattern.match(name)
+        if match:
+            shards.append(int(match.group(1)))
+
+    return sorted(shards)
+
+
+def rebalance_shards(batch_size=1000, progress=None):
+    """
+    param batch_size: posts moved per transaction
+    param progress: called with the running total after every batch
+    return: the number of posts moved
+    """
+    for shard in post_shards():
+        if shard is not None:
+            ensure_shard(shard)
+
+    moved = 0
+
+    try:
+        for source in [None] + stored_shards():
+            src = get_shard_db(source)
+
+            for (author_id,) in src.execute(SQL['post_authors']).fetchall():
+                target = shard_for(author_id)
+                if target == source:
+                    continue
+
+                dst = get_shard_db(target)
+                while True:
+                    rows = src.execute(SQL['posts_to_move'], (author_id, batch_size)).fetchall()
+                    if not rows:
+                        break
+
+                    with dst:
+                        seq = dst.execute(SQL['post_sequence']).fetchone()
+                        # no row changes when a different post already has the id
+                        landed = [row[0] for row in rows if dst.execute(SQL['posts_move'], row).rowcount]
+                        # the moved ids may come from a higher range, keep handing out ids from the target's own
+                        dst.execute(SQL['post_sequence_set'], (seq[0] if seq else shard_id_start(target),))
+                    with src:
+                        src.executemany(SQL['post_delete'], [(id,) for id in landed])
+
+                    moved += len(landed)
+                    if progress is not None:
+                        progress(moved)
+
+                    if len(landed) < len(rows):
+                        ids = ', '.join(str(row[0]) for row in rows if row[0] not in landed)
+                        raise click.ClickException(
+                            f'Posts {ids} were left where they are, shard {target} has other posts with the same ids.'
+                        )
+    finally:
+        current_app.extensions.pop('flaskr.shards.unbalanced', None)
+
+    # count every author's posts again, wherever they are now
+    counts = {}
+    for shard in post_shards():
+        for author_id, count in get_shard_db(shard).execute(SQL['post_counts']):
+            counts[author_id] = counts.get(author_id, 0) + count
+
+    db = get_db()
+    with db:
+        db.execute(SQL['user_post_count_reset'])
+        db.executemany(SQL['user_set_post_count'], [(count, author_id) for author_id, count in counts.items()])
+
+    return moved
+
+    '''
+    Posts are routed by author_id % DATABASE_SHARDS, so after changing DATABASE_SHARDS 
+    most authors' posts are on the wrong shard, or still in the main database when sharding was just turned on. 
+    Each batch is copied to its new shard and committed before it is deleted from the old one, 
+    and a copy that is there already from an interrupted run is overwritten, so the rebalance can simply be run again. 
+    A different post with the same id is never overwritten, and the post that would have replaced it stays where it is. 
+    Moved posts keep their ids, which belong to the range of the shard they were created on. 
+    Inserting them would raise the target's AUTOINCREMENT counter into that range, 
+    so it is set back after each batch, and new posts take their id from the counter, see NEXT_POST_ID, 
+    instead of from the highest id in the table; otherwise they could get an id the old shard still hands out. 
+    Until it has finished, the views also read the main database and the shards that were dropped, see unbalanced_shards, 
+    so posts that haven't moved yet can still be opened, updated and deleted, and are in the listings. 
+    An author's page only reads the author's shard besides those, 
+    so after changing the number of shards it misses the posts still on another shard in DATABASE_SHARDS.
+    '''
+
+
+@click.command('rebalance-shards')
+@click.option('--batch-size', default=1000, show_default=True, help='Posts moved per transaction.')
+@with_appcontext
+def rebalance_shards_command(batch_size):
+    # Move the posts to the shards DATABASE_SHARDS says they belong on.
+    moved = rebalance_shards(batch_size)
+    click.echo(f'Moved {moved} posts')
+
+
+@click.command('convert-timestamps')
+@with_appcontext
+def convert_timestamps_command():
+    # Convert the stored post timestamps after changing EPOCH_TIMESTAMPS.
+    count = convert_timestamps()
+    click.echo(f'Converted {count} timestamps')
+
+
+@click.command('db-upgrade')
+@click.option('--to', 'target', type=int, help='Version to upgrade to, the latest by default.')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows backfilled per transaction.')
+@click.option('--pause', default=0.01, show_default=True, help='Seconds to wait between transactions.')
+@with_appcontext
+def upgrade_db_command(target, batch_size, pause):
+    # Bring the database up to date without losing its data, while the site keeps running.
+    version = upgrade_db(target, batch_size, pause, lambda n, name: click.echo(f'Applying {n}: {name}'))
+    click.echo(f'The database is at version {version}')
+
+
+@click.command('rebuild-search')
+@with_appcontext
+def rebuild_search_command():
+    # Create the search index if needed and fill it from the existing posts.
+    rebuild_search_index()
+    click.echo('Rebuilt the search index')
+
+
 def init_app(app):
     # Register database functions with the Flask app. This is called by the application factory.
+    if sqlite3.sqlite_version_info < SQLITE_MIN_VERSION:
+        raise RuntimeError(
+            f"flaskr needs SQLite {'.'.join(map(str, SQLITE_MIN_VERSION))} or newer,"
+            f' but Python uses SQLite {sqlite3.sqlite_version}.'
+        )
+
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(rebuild_search_command)
+    app.cli.add_command(convert_timestamps_command)
+    app.cli.add_command(upgrade_db_command)
+    app.cli.add_command(rebalance_shards_command)
+
+    if app.config['DATABASE_SHARDS'] > 1 and os.path.exists(app.config['DATABASE']):
+        # a shard added by raising DATABASE_SHARDS needs its file before the first request reads from it
+        with app.app_context():
+            for shard in post_shards():
+                ensure_shard(shard)
+        close_pool(app)
 
     '''
     app.teardown_appcontext() 
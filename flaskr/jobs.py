@@ -0,0 +1,214 @@
+import json
+import os
+import signal
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from flaskr.db import get_db, get_read_db, write
+from flaskr.queries import SQL
+
+# The functions that can be run as jobs, by name.
+JOBS = {}
+
+
+# Decorator that lets a function be enqueued as a job.
+def job(fn):
+    JOBS[f'{fn.__module__}.{fn.__name__}'] = fn
+    return fn
+
+
+def enqueue(fn, *args, delay=0):
+    """
+    param fn: a function decorated with @job
+    param args: JSON serializable arguments to call it with
+    param delay: seconds to wait before the job is run
+    return: id of the new job
+    """
+    name = f'{fn.__module__}.{fn.__name__}'
+    id = write(SQL['job_insert'], (name, json.dumps(args), time.time() + delay))
+
+    runner = current_app.extensions.get('flaskr.jobs')
+    if runner is not None:
+        runner.wake()
+
+    return id
+
+    '''
+    The job is committed through the same group commit as the view's other writes,
+    so once enqueue returns it survives a crash, and the view can answer straight away.
+    '''
+
+
+# Seconds to wait before a job that failed `attempts` times is tried again.
+def retry_delay(attempts):
+    return current_app.config['JOB_RETRY_DELAY'] * 2 ** (attempts - 1)
+
+
+def run_next():
+    """
+    return: True if a job was due and has been run, whether it succeeded or not
+    """
+    now = time.time()
+
+    # most polls find nothing due, and a read doesn't take the write lock from the writers
+    if get_read_db().execute(SQL['job_due'], (now,)).fetchone() is None:
+        return False
+
+    db = get_db()
+
+    with db:
+        # taking a job hides it from other workers until JOB_TIMEOUT has passed
+        rows = db.execute(SQL['job_claim'], (now + current_app.config['JOB_TIMEOUT'], now)).fetchall()
+
+    if not rows:
+        return False
+
+    id, name, args, attempts = rows[0]
+
+    try:
+        if name not in JOBS:
+            raise LookupError(f'Unknown job {name!r}.')
+        JOBS[name](*json.loads(args))
+    except Exception as e:
+        current_app.logger.exception('Job %d %s failed on attempt %d', id, name, attempts)
+        # None parks the job for good, with its last error
+        run_at = time.time() + retry_delay(attempts) if attempts < current_app.config['JOB_MAX_ATTEMPTS'] else None
+        write(SQL['job_retry'], (run_at, repr(e), id, attempts))
+    else:
+        write(SQL['job_done'], (id, attempts))
+
+    return True
+
+    '''
+    A job is only deleted once it has finished, so one whose worker died is simply taken again
+    when its JOB_TIMEOUT runs out, and a job may run more than once: jobs should be safe to repeat.
+    The attempts check keeps a worker that overran the timeout from deleting or rescheduling
+    the job another worker has taken since.
+    '''
+
+
+def run_jobs():
+    """
+    return: the number of jobs run until none were due
+    """
+    count = 0
+
+    while True:
+        with current_app.app_context():
+            if not run_next():
+                return count
+        count += 1
+
+
+# Runs due jobs on a few threads of the current process, checking for new ones every poll_interval seconds.
+class JobRunner(object):
+    def __init__(self, app, threads=2, poll_interval=1.0):
+        self.app = app
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid != os.getpid():
+                # threads don't survive a fork, start them in this process
+                self._stopping = threading.Event()
+                self._wake = threading.Event()
+                self._threads = [
+                    threading.Thread(target=self._run, name=f'flaskr-jobs-{n}', daemon=True)
+                    for n in range(self.threads)
+                ]
+                for thread in self._threads:
+                    thread.start()
+                self._pid = os.getpid()
+
+    def wake(self):
+        # Let an idle thread look for jobs now instead of at its next poll.
+        if self._pid == os.getpid():
+            self._wake.set()
+
+    def close(self):
+        if self._pid == os.getpid():
+            self._stopping.set()
+            self._wake.set()
+            for thread in self._threads:
+                thread.join()
+        self._pid = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                with self.app.app_context():
+                    ran = run_next()
+            except Exception:
+                # e.g. the database is locked for longer than the busy timeout, try again later
+                self.app.logger.exception('Could not take a job')
+                ran = False
+
+            if not ran:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    '''
+    Each job runs in an app context of its own, so it can use get_db() and write() like a view,
+    and its connections go back to the pool when it is done.
+    '''
+
+
+def get_runner(app):
+    runner = app.extensions.get('flaskr.jobs')
+
+    if runner is None:
+        runner = app.extensions['flaskr.jobs'] = JobRunner(
+            app,
+            threads=app.config['JOB_WORKERS'],
+            poll_interval=app.config['JOB_POLL_INTERVAL'],
+        )
+
+    return runner
+
+
+@click.command('worker')
+@click.option('--threads', type=int, help='Jobs run at the same time, JOB_WORKERS or 1 by default.')
+@click.option('--burst', is_flag=True, help='Run the jobs that are due and exit.')
+@with_appcontext
+def worker_command(threads, burst):
+    # Run background jobs until stopped with Ctrl-C or SIGTERM.
+    if burst:
+        click.echo(f'Ran {run_jobs()} jobs')
+        return
+
+    app = current_app._get_current_object()
+    threads = threads or app.config['JOB_WORKERS'] or 1
+    runner = app.extensions['flaskr.jobs'] = JobRunner(app, threads, app.config['JOB_POLL_INTERVAL'])
+    stopping = threading.Event()
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+
+    runner.start()
+    click.echo(f'Running jobs on {threads} threads')
+    stopping.wait()
+    runner.close()
+
+
+def init_app(app):
+    # Run jobs on threads of every process that serves requests, and register the worker command.
+    app.cli.add_command(worker_command)
+
+    if app.config['JOB_WORKERS'] > 0:
+        app.before_request(lambda: get_runner(app).start())
+
+    '''
+    The threads are started by the first request of each process rather than by create_app,
+    so the prefork master and commands like init-db don't run jobs, and forked workers start their own.
+    With JOB_WORKERS = 0 only flask worker runs jobs.
+    '''
@@ -0,0 +1,178 @@
+import hmac
+import threading
+import time
+from collections import defaultdict
+
+from flask import g, request, current_app, abort, before_render_template, template_rendered
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# Request latency histograms and query counters per endpoint, for one worker process.
+class Metrics(object):
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._counts = defaultdict(lambda: [0] * (len(buckets) + 1))
+        self._seconds = defaultdict(float)
+        self._queries = defaultdict(int)
+        self._query_seconds = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, seconds, queries):
+        with self._lock:
+            counts = self._counts[endpoint]
+            for n, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[n] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._seconds[endpoint] += seconds
+            self._queries[endpoint] += len(queries)
+            self._query_seconds[endpoint] += sum(q[1] for q in queries)
+
+    def render(self, counters=()):
+        """
+        param counters: extra (name, help, value) counters to include
+        return: every metric in the Prometheus text format
+        """
+        lines = [
+            '# HELP flaskr_request_duration_seconds Request latency by endpoint.',
+            '# TYPE flaskr_request_duration_seconds histogram',
+        ]
+
+        with self._lock:
+            for endpoint, counts in sorted(self._counts.items()):
+                total = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    total += count
+                    lines.append(f'flaskr_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {total}')
+                lines.append(f'flaskr_request_duration_seconds_sum{{endpoint="{endpoint}"}} {self._seconds[endpoint]}')
+                lines.append(f'flaskr_request_duration_seconds_count{{endpoint="{endpoint}"}} {total}')
+
+            for name, help, values in (
+                ('flaskr_db_queries_total', 'SQL statements run by endpoint.', self._queries),
+                (
+                    'flaskr_db_query_seconds_total',
+                    'Time spent in SQL statements by endpoint, reading their rows included only with QUERY_TIMING.',
+                    self._query_seconds,
+                ),
+            ):
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} counter')
+                for endpoint, value in sorted(values.items()):
+                    lines.append(f'{name}{{endpoint="{endpoint}"}} {value}')
+
+        for name, help, value in counters:
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+    '''
+    Each bucket only counts the requests that fell into it, and render() adds them up,
+    since Prometheus buckets are cumulative: le="0.1" includes everything at or below 100ms.
+    '''
+
+
+def get_metrics(app):
+    metrics = app.extensions.get('flaskr.metrics')
+
+    if metrics is None:
+        metrics = app.extensions['flaskr.metrics'] = Metrics()
+
+    return metrics
+
+
+def start_timer():
+    g.started = time.perf_counter()
+    g.template_seconds = 0.0
+
+
+def start_template(sender, template, context, **extra):
+    g.template_started = time.perf_counter()
+
+
+def stop_template(sender, template, context, **extra):
+    started = g.pop('template_started', None)
+    if started is not None:
+        g.template_seconds += time.perf_counter() - started
+
+
+# Tell the browser where the time went, in milliseconds.
+def add_server_timing(response):
+    if 'started' in g:
+        db = sum(q[1] for q in g.get('queries', ()))
+        total = time.perf_counter() - g.started
+        response.headers['Server-Timing'] = (
+            f'db;dur={db * 1000:.1f}, tpl;dur={g.template_seconds * 1000:.1f}, total;dur={total * 1000:.1f}'
+        )
+    return response
+
+
+# Record the request and log its slow queries once the response has been sent.
+def record_request(e=None):
+    if 'started' not in g:
+        return
+
+    seconds = time.perf_counter() - g.started
+    queries = g.get('queries', ())
+    threshold = current_app.config['SLOW_QUERY_THRESHOLD']
+
+    for sql, query_seconds, rows in queries:
+        if query_seconds >= threshold:
+            current_app.logger.warning(
+                'Slow query (%.1fms, %d rows) in %s: %s', query_seconds * 1000, rows, request.endpoint, sql
+            )
+
+    get_metrics(current_app).observe(request.endpoint or 'none', seconds, queries)
+
+
+# Only let the scraper see the metrics: with METRICS_TOKEN as a bearer token, or from this machine without one.
+def check_metrics_access():
+    token = current_app.config['METRICS_TOKEN']
+
+    if token:
+        scheme, _, given = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(given.encode(), token.encode()):
+            abort(403)
+    elif request.remote_addr not in ('127.0.0.1', '::1'):
+        abort(403)
+
+
+def metrics():
+    check_metrics_access()
+
+    from flaskr.cache import get_page_cache
+    from flaskr.db import get_writer
+
+    cache = get_page_cache(current_app)
+    writer = get_writer(current_app)
+    body = get_metrics(current_app).render([
+        ('flaskr_page_cache_hits_total', 'Pages served from the page cache.', cache.hits),
+        ('flaskr_page_cache_misses_total', 'Pages rendered because they were not cached.', cache.misses),
+        ('flaskr_writes_total', 'Writes committed by the writer thread.', writer.writes),
+        ('flaskr_write_groups_total', 'Transactions committed by the writer thread.', writer.groups),
+    ])
+    return body, 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+def init_app(app):
+    # Time every request, and serve the numbers on /metrics.
+    app.before_request(start_timer)
+    app.after_request(add_server_timing)
+    app.teardown_request(record_request)
+    before_render_template.connect(start_template, app)
+    template_rendered.connect(stop_template, app)
+
+    if app.config['METRICS']:
+        from flaskr.auth import skip_user
+        app.add_url_rule('/metrics', 'metrics', skip_user(metrics))
+
+    '''
+    The statements themselves are timed by the connections from flaskr.db, which add them to g.queries.
+    teardown_request runs after a streamed response has finished,
+    so the latency recorded there includes the whole body, while Server-Timing,
+    which has to be sent before the body, only covers the work done up to the headers.
+    '''
@@ -0,0 +1,138 @@
+# The schema changes since the first version of schema.sql, oldest first.
+# Migration n brings a database from PRAGMA user_version n - 1 to n, and schema.sql always creates the latest version.
+# Every step checks what is there already, so an upgrade that was interrupted can simply be run again.
+
+from flask import current_app
+
+from flaskr.blog import make_excerpt
+
+
+def add_column(db, table, column, definition):
+    # table may name its schema, like main.post, which PRAGMA wants in front
+    schema, _, name = table.rpartition('.')
+    columns = [row[1] for row in db.execute(f'PRAGMA {schema or "main"}.table_info({name})')]
+
+    if column not in columns:
+        with db:
+            db.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+# Run statements in one short transaction of their own.
+def run(db, *statements):
+    with db:
+        for sql in statements:
+            db.execute(sql)
+
+
+def post_created_at_index(db, backfill):
+    run(db, 'CREATE INDEX IF NOT EXISTS post_created_at_id ON post (created_at, id)')
+
+
+def post_excerpt(db, backfill):
+    length = current_app.config['EXCERPT_LENGTH']
+    add_column(db, 'post', 'excerpt', "TEXT NOT NULL DEFAULT ''")
+    backfill(
+        "SELECT id, body FROM post WHERE id > ? AND excerpt = '' AND body != '' ORDER BY id LIMIT ?",
+        'UPDATE post SET excerpt = ? WHERE id = ?',
+        lambda row: (make_excerpt(row[1], length), row[0]),
+    )
+
+
+def user_post_count(db, backfill):
+    add_column(db, 'user', 'post_count', 'INTEGER NOT NULL DEFAULT 0')
+    run(db, 'CREATE INDEX IF NOT EXISTS post_author_created_at ON post (author_id, created_at, id)')
+    run(
+        db,
+        'CREATE TRIGGER IF NOT EXISTS post_count_insert AFTER INSERT ON post BEGIN'
+        ' UPDATE user SET post_count = post_count + 1 WHERE id = new.author_id; END',
+        'CREATE TRIGGER IF NOT EXISTS post_count_delete AFTER DELETE ON post BEGIN'
+        ' UPDATE user SET post_count = post_count - 1 WHERE id = old.author_id; END',
+        'CREATE TRIGGER IF NOT EXISTS post_count_update AFTER UPDATE OF author_id ON post BEGIN'
+        ' UPDATE user SET post_count = post_count - 1 WHERE id = old.author_id;'
+        ' UPDATE user SET post_count = post_count + 1 WHERE id = new.author_id; END',
+    )
+    backfill(
+        'SELECT id FROM user WHERE id > ? ORDER BY id LIMIT ?',
+        'UPDATE user SET post_count = (SELECT count(*) FROM post WHERE author_id = ?) WHERE id = ?',
+        lambda row: (row[0], row[0]),
+    )
+
+    '''
+    The triggers are in place before the counts are filled in, and every batch sets a count
+    from the posts as they are inside its own transaction, so posts written meanwhile are never lost or counted twice.
+    '''
+
+
+def post_search_index(db, backfill):
+    from flaskr.db import rebuild_search_index
+    rebuild_search_index()
+
+    '''
+    FTS5 can only fill an external content index in one go, so this is the one step that isn't batched.
+    '''
+
+
+def job_queue(db, backfill):
+    run(
+        db,
+        'CREATE TABLE IF NOT EXISTS job (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL,'
+        " args TEXT NOT NULL DEFAULT '[]', run_at REAL, attempts INTEGER NOT NULL DEFAULT 0, error TEXT)",
+        'CREATE INDEX IF NOT EXISTS job_run_at ON job (run_at)',
+    )
+
+
+# The connections to the main database and to every post shard that has to be upgraded.
+def post_databases(db):
+    from flaskr.db import get_shard_db, ensure_shard, post_shards, stored_shards
+
+    yield db
+
+    for shard in sorted(set(stored_shards()) | set(post_shards()) - {None}):
+        # a shard that is created now gets the latest schema from shard.sql
+        if not ensure_shard(shard):
+            yield get_shard_db(shard)
+
+    '''
+    The main database keeps its post table when sharding is turned on, with the posts not yet moved by rebalance-shards, 
+    and shards that are no longer in DATABASE_SHARDS may still hold posts until then, so all of them are upgraded.
+    '''
+
+
+# Add a column to the post table of the main database and of every post shard.
+def add_post_column(db, column, definition):
+    for post_db in post_databases(db):
+        # main. is the shard, not the main database attached to it read-only
+        add_column(post_db, 'main.post', column, definition)
+
+
+def post_updated_at(db, backfill):
+    add_post_column(db, 'updated_at', 'TIMESTAMP')
+
+
+def post_version(db, backfill):
+    add_post_column(db, 'version', 'INTEGER NOT NULL DEFAULT 0')
+
+
+def post_change_count(db, backfill):
+    with current_app.open_resource('changes.sql') as f:
+        script = f.read().decode('utf8')
+
+    for post_db in post_databases(db):
+        post_db.executescript(script)
+
+
+MIGRATIONS = [
+    post_created_at_index,
+    post_excerpt,
+    user_post_count,
+    post_search_index,
+    job_queue,
+    post_updated_at,
+    post_version,
+    post_change_count,
+]
+
+'''
+SQLite builds an index in a single statement and can't spread it over several transactions,
+so each index gets a transaction to itself, and readers carry on meanwhile under WAL.
+'''
@@ -0,0 +1,88 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+# Runs password hashing on a small pool of worker threads, refusing work once too much is waiting.
+class PasswordHasher(object):
+    def __init__(self, method='scrypt', workers=2, max_pending=8):
+        self.method = method
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pid = None
+        self._prefix = None
+        self._lock = threading.Lock()
+
+    def _submit(self, fn, *args):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # worker threads don't survive a fork, start a new pool in this process
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='flaskr-hash')
+                    self._slots = threading.BoundedSemaphore(self.max_pending)
+                    # set last, so other threads only skip the check once the pool is ready
+                    self._pid = os.getpid()
+
+        if not self._slots.acquire(blocking=False):
+            raise ServiceUnavailable('Too many password checks at once, try again shortly.', retry_after=1)
+
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda f: self._slots.release())
+        return future.result()
+
+    def hash(self, password):
+        return self._submit(generate_password_hash, password, self.method)
+
+    def check(self, pwhash, password):
+        return self._submit(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        # Tell whether a stored hash was made with other parameters than the configured ones.
+        if self._prefix is None:
+            # werkzeug fills in the default cost for short methods like 'scrypt', so ask it once, on the pool
+            self._prefix = self.hash('').split('$', 1)[0]
+
+        return pwhash.split('$', 1)[0] != self._prefix
+
+    '''
+    Hashing is deliberately slow and CPU bound.
+    Running it on at most `workers` threads keeps a burst of logins from occupying every core,
+    and the semaphore caps how many requests may wait for a hash at all:
+    past max_pending the request fails fast with 503 and Retry-After instead of queueing.
+    Every hash goes through _submit, including the one needs_rehash makes to learn the configured parameters 
+    and the new hash a login stores in place of an outdated one.
+    '''
+
+
+def get_hasher(app):
+    hasher = app.extensions.get('flaskr.passwords')
+
+    if hasher is None:
+        hasher = app.extensions['flaskr.passwords'] = PasswordHasher(
+            method=app.config['PASSWORD_HASH_METHOD'],
+            workers=app.config['PASSWORD_HASH_WORKERS'],
+            max_pending=app.config['PASSWORD_HASH_MAX_PENDING'],
+        )
+
+    return hasher
+
+
+def hash_password(password):
+    return get_hasher(current_app).hash(password)
+
+
+def check_password(pwhash, password):
+    return get_hasher(current_app).check(pwhash, password)
+
+
+def needs_rehash(pwhash):
+    return get_hasher(current_app).needs_rehash(pwhash)
@@ -0,0 +1,163 @@
+# Every SQL statement the views and commands run, by name.
+# Keeping them in one place lets the tests check all of their query plans.
+
+POSTS = (
+    'SELECT p.id, title, body, created_at, author_id, username'
+    ' FROM post p JOIN user u ON p.author_id = u.id'
+)
+
+EXCERPTS = (
+    'SELECT p.id, title, excerpt, created_at, version, author_id, username'
+    ' FROM post p JOIN user u ON p.author_id = u.id'
+)
+
+# The next id from the post table's AUTOINCREMENT counter, which rebalance_shards keeps in the shard's own id range.
+# Left to itself SQLite would continue after the highest id in the table, which may be a post moved from another shard.
+NEXT_POST_ID = "(SELECT seq + 1 FROM sqlite_sequence WHERE name = 'post')"
+
+SQL = {
+    'posts_latest': EXCERPTS + ' ORDER BY p.created_at DESC, p.id DESC LIMIT ?',
+    'posts_before': EXCERPTS + ' WHERE (p.created_at, p.id) < (?, ?) ORDER BY p.created_at DESC, p.id DESC LIMIT ?',
+    'posts_after': EXCERPTS + ' WHERE (p.created_at, p.id) > (?, ?) ORDER BY p.created_at, p.id LIMIT ?',
+    'post_by_id': POSTS + ' WHERE p.id = ?',
+    # just enough of the posts to tell whether the API's responses changed, see api.conditional()
+    'post_versions_latest': 'SELECT id, created_at, version FROM post ORDER BY created_at DESC, id DESC LIMIT ?',
+    'post_versions_before': (
+        'SELECT id, created_at, version FROM post WHERE (created_at, id) < (?, ?)'
+        ' ORDER BY created_at DESC, id DESC LIMIT ?'
+    ),
+    'post_versions_after': (
+        'SELECT id, created_at, version FROM post WHERE (created_at, id) > (?, ?) ORDER BY created_at, id LIMIT ?'
+    ),
+    'post_version': 'SELECT id, author_id, version FROM post WHERE id = ?',
+    'author_posts_latest': (
+        EXCERPTS + ' WHERE p.author_id = ? ORDER BY p.created_at DESC, p.id DESC LIMIT ?'
+    ),
+    'author_posts_before': (
+        EXCERPTS + ' WHERE p.author_id = ? AND (p.created_at, p.id) < (?, ?)'
+        ' ORDER BY p.created_at DESC, p.id DESC LIMIT ?'
+    ),
+    'author_posts_after': (
+        EXCERPTS + ' WHERE p.author_id = ? AND (p.created_at, p.id) > (?, ?)'
+        ' ORDER BY p.created_at, p.id LIMIT ?'
+    ),
+    'post_search': (
+        'SELECT p.id, created_at, author_id, username, rank,'
+        ' highlight(post_fts, 0, char(2), char(3)) AS title,'
+        " snippet(post_fts, 1, char(2), char(3), '…', 24) AS snippet"
+        ' FROM post_fts JOIN post p ON p.id = post_fts.rowid JOIN user u ON p.author_id = u.id'
+        ' WHERE post_fts MATCH ?'
+        ' ORDER BY rank'
+        ' LIMIT ? OFFSET ?'
+    ),
+    'post_insert': (
+        'INSERT INTO post (id, title, excerpt, body, author_id, created_at)'
+        f' VALUES ({NEXT_POST_ID}, ?, ?, ?, ?, ?)'
+    ),
+    'post_update': (
+        'UPDATE post SET title = ?, excerpt = ?, body = ?, updated_at = ?, version = version + 1 WHERE id = ?'
+    ),
+    'post_delete': 'DELETE FROM post WHERE id = ?',
+    'posts_export': (
+        'SELECT title, body, username, created_at'
+        ' FROM post p JOIN user u ON p.author_id = u.id'
+        ' ORDER BY p.id'
+    ),
+    'posts_import': (
+        'INSERT INTO post (id, title, excerpt, body, author_id, created_at)'
+        f' VALUES ({NEXT_POST_ID}, ?, ?, ?, ?, ?)'
+    ),
+    'timestamps_to_epoch': (
+        "UPDATE post SET created_at = CAST(strftime('%s', created_at) AS INTEGER) WHERE typeof(created_at) = 'text'"
+    ),
+    'timestamps_to_text': (
+        "UPDATE post SET created_at = datetime(created_at, 'unixepoch') WHERE typeof(created_at) = 'integer'"
+    ),
+    'post_authors': 'SELECT DISTINCT author_id FROM post',
+    'post_counts': 'SELECT author_id, count(*) FROM post GROUP BY author_id',
+    'posts_to_move': (
+        'SELECT id, author_id, created_at, title, excerpt, body, updated_at, version FROM post'
+        ' WHERE author_id = ? ORDER BY created_at, id LIMIT ?'
+    ),
+    'posts_move': (
+        'INSERT INTO post (id, author_id, created_at, title, excerpt, body, updated_at, version)'
+        ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)'
+        ' ON CONFLICT (id) DO UPDATE SET title = excluded.title, excerpt = excluded.excerpt, body = excluded.body,'
+        ' updated_at = excluded.updated_at, version = excluded.version'
+        # only a copy of the same post, left by a rebalance that was interrupted
+        ' WHERE author_id = excluded.author_id AND created_at = excluded.created_at'
+    ),
+    'post_max_id': 'SELECT max(id) FROM post',
+    'post_changes': 'SELECT changes FROM post_changes WHERE id = 1',
+    'post_sequence': "SELECT seq FROM sqlite_sequence WHERE name = 'post'",
+    'post_sequence_set': "UPDATE sqlite_sequence SET seq = ? WHERE name = 'post'",
+    'search_rebuild': "INSERT INTO post_fts (post_fts) VALUES ('rebuild')",
+    'user_by_id': 'SELECT id, username FROM user WHERE id = ?',
+    'user_profile': 'SELECT id, username, post_count FROM user WHERE username = ?',
+    'user_login': 'SELECT id, password FROM user WHERE username = ?',
+    'user_id_by_username': 'SELECT id FROM user WHERE username = ?',
+    'user_insert': 'INSERT INTO user (username, password) VALUES (?, ?)',
+    'user_set_password': 'UPDATE user SET password = ? WHERE id = ?',
+    'user_add_post_count': 'UPDATE user SET post_count = post_count + ? WHERE id = ?',
+    'user_set_post_count': 'UPDATE user SET post_count = ? WHERE id = ?',
+    'user_post_count_reset': 'UPDATE user SET post_count = 0',
+    'job_insert': 'INSERT INTO job (name, args, run_at) VALUES (?, ?, ?)',
+    'job_due': 'SELECT id FROM job WHERE run_at <= ? LIMIT 1',
+    'job_claim': (
+        'UPDATE job SET run_at = ?, attempts = attempts + 1'
+        ' WHERE id = (SELECT id FROM job WHERE run_at <= ? ORDER BY run_at LIMIT 1)'
+        ' RETURNING id, name, args, attempts'
+    ),
+    'job_done': 'DELETE FROM job WHERE id = ? AND attempts = ?',
+    'job_retry': 'UPDATE job SET run_at = ?, error = ? WHERE id = ? AND attempts = ?',
+}
+
+# Statements that read a whole table on purpose.
+FULL_SCANS = {
+    'posts_export', 'timestamps_to_epoch', 'timestamps_to_text', 'user_post_count_reset',
+    'post_authors', 'post_counts',
+    # sqlite_sequence has one row per AUTOINCREMENT table
+    'post_insert', 'posts_import', 'post_sequence', 'post_sequence_set',
+}
+
+# Room in each connection's statement cache for every registered statement plus a few ad hoc ones,
+# and never less than the sqlite3 default of 128.
+STATEMENT_CACHE_SIZE = max(128, len(SQL) + 16)
+
+
+def explain(db, name):
+    """
+    param db: connection to a database with the flaskr schema
+    param name: key of the statement in SQL
+    return: the detail lines of its EXPLAIN QUERY PLAN
+    """
+    sql = SQL[name]
+    rows = db.execute('EXPLAIN QUERY PLAN ' + sql, (None,) * sql.count('?')).fetchall()
+    return [row[3] for row in rows]
+
+
+def check_plans(db):
+    """
+    param db: connection to a database with the flaskr schema, ideally filled like production
+    return: a description of every plan that scans a table or sorts in a temporary B-tree
+    """
+    problems = []
+
+    for name, sql in SQL.items():
+        for detail in explain(db, name):
+            scan = detail.startswith('SCAN ') and 'VIRTUAL TABLE' not in detail
+            # walking an index in order is only cheap when the LIMIT stops it early
+            if ' USING ' in detail and ' LIMIT ' in sql:
+                scan = False
+            if (scan and name not in FULL_SCANS) or 'TEMP B-TREE' in detail:
+                problems.append(f'{name}: {detail}')
+
+    return problems
+
+    '''
+    SQLite says SCAN when it visits every row of a table, and USE TEMP B-TREE when it has to sort the results itself.
+    Either one makes a statement slower the more posts there are,
+    which a small test database never shows in the timings but always shows in the plan.
+    A SCAN ... USING INDEX walks an index in order, which is fine when the statement has a LIMIT to stop it,
+    but without one it still visits every row, just in index order.
+    '''
@@ -1,17 +1,56 @@
+DROP TABLE IF EXISTS post_fts;
 DROP TABLE IF EXISTS user;
 DROP TABLE IF EXISTS post;
+DROP TABLE IF EXISTS job;
 
 CREATE TABLE user (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     username TEXT UNIQUE NOT NULL,
-    password TEXT NOT NULL
+    password TEXT NOT NULL,
+    post_count INTEGER NOT NULL DEFAULT 0
 );
 
 CREATE TABLE post (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     author_id INTEGER NOT NULL,
     created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    -- when the post was last edited, NULL if it never was
+    updated_at TIMESTAMP,
+    -- raised by every edit, so caches can tell versions of a post apart
+    version INTEGER NOT NULL DEFAULT 0,
     title TEXT NOT NULL,
+    -- before body, so listing excerpts never reads the overflow pages of a long body
+    excerpt TEXT NOT NULL DEFAULT '',
     body TEXT NOT NULL,
     FOREIGN KEY (author_id) REFERENCES user (id)
 );
+
+CREATE INDEX post_created_at_id ON post (created_at, id);
+CREATE INDEX post_author_created_at ON post (author_id, created_at, id);
+
+-- keep user.post_count in step with the posts, so nothing has to count them
+CREATE TRIGGER post_count_insert AFTER INSERT ON post BEGIN
+    UPDATE user SET post_count = post_count + 1 WHERE id = new.author_id;
+END;
+
+CREATE TRIGGER post_count_delete AFTER DELETE ON post BEGIN
+    UPDATE user SET post_count = post_count - 1 WHERE id = old.author_id;
+END;
+
+CREATE TRIGGER post_count_update AFTER UPDATE OF author_id ON post BEGIN
+    UPDATE user SET post_count = post_count - 1 WHERE id = old.author_id;
+    UPDATE user SET post_count = post_count + 1 WHERE id = new.author_id;
+END;
+
+-- background jobs, see flaskr/jobs.py
+CREATE TABLE job (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    args TEXT NOT NULL DEFAULT '[]',
+    -- when the job can be taken next, NULL once it has failed too often
+    run_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+
+CREATE INDEX job_run_at ON job (run_at);
@@ -0,0 +1,174 @@
+import os
+import signal
+import socket
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from werkzeug.serving import make_server
+
+from flaskr.db import close_pool
+from flaskr.templating import compile_templates, warm_up
+
+
+# Serve requests from the shared socket in a forked worker until told to stop or recycled.
+def run_worker(app, sock, max_requests=0):
+    stopping = False
+    handled = 0
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    # a hangup of the terminal or the process group reaches the workers too, only the master reloads
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    def counted(environ, start_response):
+        nonlocal handled
+        handled += 1
+        return app(environ, start_response)
+
+    if app.config['WARM_UP']:
+        warm_up(app)
+
+    server = make_server(*sock.getsockname()[:2], counted, fd=sock.fileno())
+    server.timeout = 0.5
+
+    while not stopping and not (max_requests and handled >= max_requests):
+        server.handle_request()
+
+    close_pool(app)
+    return 0
+
+    '''
+    handle_request() serves one connection and returns, or returns after `timeout` seconds without one,
+    so the loop notices a SIGTERM within half a second and never in the middle of a request.
+    The worker exits after max_requests requests, and the master starts a fresh one,
+    which keeps any slow leak from growing without bound.
+    '''
+
+
+# Pre-forks workers that share one listening socket, and replaces them as they exit.
+class PreforkServer(object):
+    def __init__(self, create_app, app, host, port, workers, max_requests=0):
+        self.create_app = create_app
+        self.app = app
+        self.workers = workers
+        self.max_requests = max_requests
+        self.pids = set()
+        self._stopping = False
+        self._reloading = False
+
+        self.sock = socket.create_server((host, port), backlog=128)
+        self.sock.set_inheritable(True)
+
+    def spawn(self):
+        pid = os.fork()
+
+        if pid == 0:
+            code = 1
+            try:
+                self.sock.set_inheritable(False)
+                code = run_worker(self.app, self.sock, self.max_requests)
+            finally:
+                os._exit(code)
+
+        self.pids.add(pid)
+
+    def prepare(self, app):
+        # Do the shared work once in the master, and leave nothing behind that can't cross a fork.
+        compile_templates(app)
+        close_pool(app)
+        return app
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGHUP, self._reload)
+        self.prepare(self.app)
+
+        for _ in range(self.workers):
+            self.spawn()
+
+        while not self._stopping:
+            if self._reloading:
+                self._reloading = False
+                self.reload()
+
+            self.reap()
+            while len(self.pids) < self.workers and not self._stopping:
+                self.spawn()
+            time.sleep(0.1)
+
+        for pid in self.pids:
+            os.kill(pid, signal.SIGTERM)
+        while self.pids:
+            self.pids.discard(os.waitpid(-1, 0)[0])
+        self.sock.close()
+
+    def reap(self):
+        while self.pids:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.pids.clear()
+                return
+            if pid == 0:
+                return
+            self.pids.discard(pid)
+
+    def reload(self):
+        # Start workers with a freshly created app, then let the old ones finish their requests and exit.
+        self.app = self.prepare(self.create_app())
+        old = set(self.pids)
+        self.pids.clear()
+
+        for _ in range(self.workers):
+            self.spawn()
+        for pid in old:
+            os.kill(pid, signal.SIGTERM)
+        for pid in old:
+            os.waitpid(pid, 0)
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+
+    def _reload(self, signum, frame):
+        self._reloading = True
+
+    '''
+    The app is created in the master before forking, so the workers share its memory copy-on-write
+    and start serving immediately.
+    Every worker opens its own SQLite connections after the fork,
+    the pools and the writer thread notice they are in a new process and start over.
+    All workers use the same WAL database file, where readers never wait for the writer.
+    SIGHUP creates the app again, which re-reads the instance config, and replaces the workers without dropping requests;
+    code changes still need a restart.
+    '''
+
+
+@click.command('serve')
+@click.option('--host', default='127.0.0.1', show_default=True)
+@click.option('--port', default=5000, show_default=True)
+@click.option('--workers', default=os.cpu_count() or 1, show_default='number of CPUs', help='Worker processes.')
+@click.option('--max-requests', default=0, help='Restart a worker after this many requests, 0 never does.')
+@with_appcontext
+def serve_command(host, port, workers, max_requests):
+    # Serve the app with pre-forked worker processes.
+    if not hasattr(os, 'fork'):
+        raise click.ClickException('serve needs os.fork(), which this platform does not have.')
+
+    from flaskr import create_app
+
+    server = PreforkServer(create_app, current_app._get_current_object(), host, port, workers, max_requests)
+    host, port = server.sock.getsockname()[:2]
+    click.echo(f'Serving on http://{host}:{port} with {workers} workers')
+    server.run()
+
+
+def init_app(app):
+    # Register the serve command with the Flask app. This is called by the application factory.
+    app.cli.add_command(serve_command)
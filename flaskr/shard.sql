@@ -0,0 +1,20 @@
+-- main. is the shard itself, without it the names could also match the tables of the attached main database
+DROP TABLE IF EXISTS main.post_fts;
+DROP TABLE IF EXISTS main.post;
+
+-- the posts of some of the authors, the users stay in the main database
+CREATE TABLE main.post (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    author_id INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    -- when the post was last edited, NULL if it never was
+    updated_at TIMESTAMP,
+    -- raised by every edit, so caches can tell versions of a post apart
+    version INTEGER NOT NULL DEFAULT 0,
+    title TEXT NOT NULL,
+    excerpt TEXT NOT NULL DEFAULT '',
+    body TEXT NOT NULL
+);
+
+CREATE INDEX main.post_created_at_id ON post (created_at, id);
+CREATE INDEX main.post_author_created_at ON post (author_id, created_at, id);
@@ -0,0 +1,66 @@
+import os
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from jinja2 import FileSystemBytecodeCache
+
+from flaskr.db import get_pool
+
+
+# A bytecode cache that creates its directory when it stores the first template, rather than when the app is created.
+class BytecodeCache(FileSystemBytecodeCache):
+    def dump_bytecode(self, bucket):
+        os.makedirs(self.directory, exist_ok=True)
+        super().dump_bytecode(bucket)
+
+
+# Compile every template, storing the bytecode in the cache if there is one.
+def compile_templates(app):
+    names = app.jinja_env.list_templates(extensions=('html',))
+
+    for name in names:
+        app.jinja_env.get_template(name)
+
+    return names
+
+
+# Load the templates and open the pooled connections before the first request needs them.
+def warm_up(app, connections=True):
+    compile_templates(app)
+
+    if connections and os.path.exists(app.config['DATABASE']):
+        for readonly in (False, True):
+            pool = get_pool(app, readonly)
+            for db in [pool.acquire() for _ in range(pool.max_size)]:
+                pool.release(db)
+
+    '''
+    A new worker compiles each template the first time it is rendered,
+    and opens each connection the first time the pool is empty,
+    so without warming up the first requests after a deploy are the slow ones.
+    Compiling a template stores its bytecode in TEMPLATE_CACHE_DIR,
+    which the other workers then load instead of compiling the template again.
+    Connections must not be shared across a fork, so a pre-forking server warms them up in each worker.
+    '''
+
+
+@click.command('compile-templates')
+@with_appcontext
+def compile_templates_command():
+    # Fill the template bytecode cache, e.g. while building a release.
+    if current_app.jinja_env.bytecode_cache is None:
+        raise click.ClickException('TEMPLATE_CACHE_DIR is not set, there is nowhere to store the bytecode.')
+
+    names = compile_templates(current_app)
+    click.echo(f'Compiled {len(names)} templates')
+
+
+def init_app(app):
+    # Store compiled templates on disk and register the compile command. This is called by the application factory.
+    cache_dir = app.config['TEMPLATE_CACHE_DIR']
+
+    if cache_dir:
+        app.jinja_env.bytecode_cache = BytecodeCache(cache_dir)
+
+    app.cli.add_command(compile_templates_command)
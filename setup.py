@@ -6,7 +6,8 @@ setup(
     packages=find_packages(),
     include_package_data=True,
     install_requires=[
-        'flask',
+        # stream_template() is new in Flask 2.2
+        'flask>=2.2',
     ],
 )
 
@@ -4,7 +4,7 @@ import tempfile
 import pytest
 
 from flaskr import create_app
-from flaskr.db import init_db, get_db
+from flaskr.db import init_db, get_db, close_pool
 
 with open(os.path.join(os.path.dirname(__file__), "data.sql"), "rb") as f:
     _data_sql = f.read().decode("utf8")
@@ -23,6 +23,11 @@ def app():
     app = create_app({
         'TESTING': True,
         'DATABASE': db_path,
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:50000',
+        'TEMPLATE_CACHE_DIR': None,
+        'ASSETS_DIR': None,
+        'JOB_WORKERS': 0,
+        'QUERY_TIMING': True,
     })
 
     '''
@@ -32,6 +37,11 @@ def app():
     
     The DATABASE path is overridden 
     so it points to this temporary path instead of the instance folder.    
+    
+    PASSWORD_HASH_METHOD matches the cheap hashes in data.sql, so logging in doesn't rehash them.
+    TEMPLATE_CACHE_DIR and ASSETS_DIR are turned off so tests don't write into or read from the instance folder.
+    JOB_WORKERS is 0 so jobs only run when a tests runs them.
+    QUERY_TIMING is on so tests can look at the statements a request ran.
     '''
 
     with app.app_context():
@@ -40,12 +50,13 @@ def app():
 
     yield app
 
+    close_pool(app)
     os.close(db_fd)
     os.unlink(db_path)
 
     '''
     After setting the path, the database tables are created and the tests data is inserted. 
-    After the tests is over, the temporary file is closed and removed.
+    After the tests is over, the pooled connections and the temporary file are closed and the file is removed.
     '''
 
 
@@ -0,0 +1,147 @@
+import pytest
+from flask import g
+
+from flaskr.api import make_token
+from flaskr.db import get_db
+
+
+@pytest.fixture
+def token(app):
+    with app.app_context():
+        return make_token(1)
+
+
+def test_posts(client):
+    response = client.get("/api/posts")
+    assert response.status_code == 200
+    assert response.json["posts"] == [{
+        "id": 1,
+        "title": "test title",
+        "excerpt": "test\nbody",
+        "created_at": "2023-01-01T00:00:00",
+        "author_id": 1,
+        "username": "test",
+    }]
+    assert response.json["next"] is None
+    assert "Set-Cookie" not in response.headers
+
+
+def test_posts_pagination(client, app):
+    app.config["POSTS_PER_PAGE"] = 2
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            "INSERT INTO post (title, body, author_id, created_at) VALUES (?, '', 1, ?)",
+            [(f"post {n}", f"2023-01-0{n} 00:00:00") for n in range(2, 6)],
+        )
+        db.commit()
+
+    page = client.get("/api/posts?fields=id").json
+    assert page["posts"] == [{"id": 5}, {"id": 4}]
+    assert page["prev"] is None
+
+    page = client.get(page["next"]).json
+    assert page["posts"] == [{"id": 3}, {"id": 2}]
+
+    page = client.get(page["prev"]).json
+    assert page["posts"] == [{"id": 5}, {"id": 4}]
+
+
+def test_fields(client):
+    assert client.get("/api/posts/1?fields=id,title").json == {"id": 1, "title": "test title"}
+
+    response = client.get("/api/posts?fields=id,password")
+    assert response.status_code == 400
+    assert response.json == {"error": "Unknown fields: password."}
+
+
+def test_post(client):
+    response = client.get("/api/posts/1")
+    assert response.json["body"] == "test\nbody"
+    assert "excerpt" not in response.json
+
+    response = client.get("/api/posts/2")
+    assert response.status_code == 404
+    assert "doesn't exist" in response.json["error"]
+
+
+def test_etag(client, token):
+    response = client.get("/api/posts")
+    etag = response.headers["ETag"]
+
+    response = client.get("/api/posts", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+
+    # a new post changes the listing, and its ETag
+    client.post("/api/posts", json={"title": "new"}, headers={"Authorization": f"Bearer {token}"})
+    response = client.get("/api/posts", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+@pytest.mark.parametrize("path", ("/api/posts", "/api/posts/1"))
+def test_etag_before_body(client, app, path):
+    etag = client.get(path).headers["ETag"]
+
+    # the 304 comes from the ids and versions alone, without the full query
+    with client:
+        response = client.get(path, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+        assert not any("JOIN user" in sql for sql, seconds, rows in g.queries)
+
+    # an edit raises the post's version, and so changes the ETag
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET body = 'edited', version = version + 1 WHERE id = 1")
+        db.commit()
+
+    response = client.get(path, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_tokens(client):
+    response = client.post("/api/tokens", json={"username": "test", "password": "test"})
+    assert response.status_code == 200
+    token = response.json["token"]
+
+    response = client.post("/api/posts", json={"title": "api", "body": "from the api"},
+                           headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 201
+    assert response.headers["Location"].endswith(f"/api/posts/{response.json['id']}")
+    assert client.get(response.headers["Location"]).json["username"] == "test"
+
+    response = client.post("/api/tokens", json={"username": "test", "password": "wrong"})
+    assert response.status_code == 401
+
+
+@pytest.mark.parametrize(("headers", "message"), (
+    ({}, "A token is required."),
+    ({"Authorization": "Bearer nonsense"}, "Invalid or expired token."),
+))
+def test_create_requires_token(client, auth, headers, message):
+    # the session cookie isn't enough
+    auth.login()
+    response = client.post("/api/posts", json={"title": "api"}, headers=headers)
+    assert response.status_code == 401
+    assert response.json == {"error": message}
+    assert response.headers["WWW-Authenticate"] == "Bearer"
+
+
+def test_create_validate(client, token):
+    response = client.post("/api/posts", json={"body": "no title"}, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("body", ([1], {"username": "test", "password": 1}, {}))
+def test_tokens_validate(client, body):
+    response = client.post("/api/tokens", json=body)
+    assert response.status_code == 400
+
+
+def test_create_not_an_object(client, token):
+    response = client.post("/api/posts", json=["title"], headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 400
+    assert response.json == {"error": "Expected a JSON object."}
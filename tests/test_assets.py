@@ -0,0 +1,75 @@
+import gzip
+import os
+
+import pytest
+from flask import url_for
+
+from flaskr import create_app
+from flaskr.assets import fingerprint
+
+
+@pytest.fixture
+def built(app, tmp_path):
+    app = create_app({
+        "TESTING": True,
+        "DATABASE": app.config["DATABASE"],
+        "TEMPLATE_CACHE_DIR": None,
+        "ASSETS_DIR": str(tmp_path),
+        "JOB_WORKERS": 0,
+    })
+    result = app.test_cli_runner().invoke(args=["build-assets"])
+    assert "Built 1 assets" in result.output
+    return app
+
+
+def test_fingerprint():
+    assert fingerprint("css/style.css", b"a") == "css/style.ca978112ca1b.css"
+    assert fingerprint("css/style.css", b"b") != fingerprint("css/style.css", b"a")
+
+
+def test_build_assets(built, tmp_path):
+    with open(os.path.join(built.static_folder, "style.css"), "rb") as f:
+        css = f.read()
+    hashed = fingerprint("style.css", css)
+
+    assert (tmp_path / hashed).read_bytes() == css
+    assert gzip.decompress((tmp_path / (hashed + ".gz")).read_bytes()) == css
+    assert hashed in (tmp_path / "manifest.json").read_text()
+
+
+def test_build_assets_without_dir(runner):
+    result = runner.invoke(args=["build-assets"])
+    assert result.exit_code != 0
+    assert "ASSETS_DIR is not set" in result.output
+
+
+def test_fingerprinted_url(built, client):
+    page = built.test_client().get("/auth/login").data
+    assert b"/static/style.css" not in page
+    assert b"/static/style." in page
+
+    # without a build the url doesn't change
+    assert b"/static/style.css" in client.get("/auth/login").data
+
+
+def test_serve_precompressed(built):
+    client = built.test_client()
+    with built.test_request_context():
+        url = url_for("static", filename="style.css")
+
+    response = client.get(url, headers={"Accept-Encoding": "gzip, deflate"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Content-Type"].startswith("text/css")
+    assert "immutable" in response.headers["Cache-Control"]
+    assert "Accept-Encoding" in response.headers["Vary"]
+    css = gzip.decompress(response.data)
+
+    response = client.get(url)
+    assert "Content-Encoding" not in response.headers
+    assert response.data == css
+    assert "immutable" in response.headers["Cache-Control"]
+
+    # the original name is still served, without the long cache lifetime
+    response = client.get("/static/style.css")
+    assert response.data == css
+    assert "immutable" not in response.headers.get("Cache-Control", "")
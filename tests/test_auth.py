@@ -1,6 +1,10 @@
+import threading
+
 import pytest
 from flask import session, g
+from werkzeug.security import generate_password_hash
 
+from flaskr.auth import get_user_cache
 from flaskr.db import get_db
 
 
@@ -66,3 +70,74 @@ def test_logout(client, auth):
     with client:
         auth.logout()
         assert 'user_id' not in session
+
+
+def test_load_user_cached(client, auth, app):
+    auth.login()
+    client.get("/")
+
+    # the cached record is used even though the row changed
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE user SET username = 'renamed' WHERE id = 1")
+        db.commit()
+
+    with client:
+        client.get("/")
+        assert g.user["username"] == "test"
+        assert "password" not in g.user.keys()
+
+    # until it is dropped from the cache
+    get_user_cache(app).delete(1)
+
+    with client:
+        client.get("/")
+        assert g.user["username"] == "renamed"
+
+
+def test_load_user_skipped(client, auth):
+    auth.login()
+
+    with client:
+        client.get("/hello")
+        assert "user" not in g
+
+        client.get("/static/style.css")
+        assert "user" not in g
+
+
+def test_login_rehash(client, auth, app):
+    app.config["PASSWORD_HASH_METHOD"] = "pbkdf2:sha256:60000"
+    assert auth.login().headers["Location"] == "/"
+
+    # the outdated hash was replaced and still matches the password
+    with app.app_context():
+        pwhash = get_db().execute("SELECT password FROM user WHERE id = 1").fetchone()[0]
+        assert pwhash.startswith("pbkdf2:sha256:60000$")
+
+    auth.logout()
+    assert auth.login().headers["Location"] == "/"
+
+
+def test_rehash_on_hash_threads(client, auth, app, monkeypatch):
+    app.config["PASSWORD_HASH_METHOD"] = "pbkdf2:sha256:60000"
+    threads = []
+
+    def generate(password, method):
+        threads.append(threading.current_thread().name)
+        return generate_password_hash(password, method)
+
+    monkeypatch.setattr("flaskr.passwords.generate_password_hash", generate)
+    assert auth.login().headers["Location"] == "/"
+
+    # learning the configured parameters and the new hash both ran on the hashing pool
+    assert len(threads) == 2
+    assert all(name.startswith("flaskr-hash") for name in threads)
+
+
+def test_hash_overloaded(client, auth, app):
+    app.config["PASSWORD_HASH_MAX_PENDING"] = 0
+
+    response = auth.login()
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
@@ -1,5 +1,6 @@
 import pytest
 
+from flaskr.blog import make_excerpt
 from flaskr.db import get_db
 
 
@@ -16,6 +17,69 @@ def test_index(client, auth):
     assert b'href="/1/update"' in response.data
 
 
+def test_index_pagination(client, app):
+    app.config["POSTS_PER_PAGE"] = 2
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            "INSERT INTO post (title, body, author_id, created_at) VALUES (?, '', 1, ?)",
+            [(f"post {n}", f"2023-01-0{n} 00:00:00") for n in range(2, 6)],
+        )
+        db.commit()
+
+    # newest first, with a link to the older posts only
+    response = client.get("/")
+    assert b"post 5" in response.data and b"post 4" in response.data
+    assert b"post 3" not in response.data
+    assert b"Older" in response.data
+    assert b"Newer" not in response.data
+
+    # the second page follows on from the last post of the first
+    response = client.get("/", query_string={"before": "2023-01-04 00:00:00,4"})
+    assert b"post 3" in response.data and b"post 2" in response.data
+    assert b"post 4" not in response.data
+    assert b"Older" in response.data and b"Newer" in response.data
+
+    # the last page has no older link
+    response = client.get("/", query_string={"before": "2023-01-02 00:00:00,2"})
+    assert b"test title" in response.data
+    assert b"Older" not in response.data
+
+    # walking back returns the posts in the same order
+    response = client.get("/", query_string={"after": "2023-01-03 00:00:00,3"})
+    assert response.data.index(b"post 5") < response.data.index(b"post 4")
+    assert b"Newer" not in response.data
+
+
+def test_index_streamed(client, app, auth):
+    app.config["STREAM_TEMPLATES"] = True
+    app.config["POSTS_PER_PAGE"] = 1
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            "INSERT INTO post (title, body, author_id, created_at)"
+            " VALUES ('newer', '', 1, '2023-01-02 00:00:00')"
+        )
+        db.commit()
+
+    auth.login()
+    response = client.get("/")
+    assert response.is_streamed
+    assert b"newer" in response.data
+    assert b"test title" not in response.data
+    assert b'href="/?before=2023-01-02+00:00:00,2"' in response.data
+
+    # the streamed page was cached once it was complete
+    response = client.get("/")
+    assert response.headers["X-Cache"] == "HIT"
+    assert b"newer" in response.data
+
+
+@pytest.mark.parametrize("cursor", ("", "2023-01-01", "2023-01-01,x"))
+def test_index_invalid_cursor(client, cursor):
+    assert client.get("/", query_string={"before": cursor}).status_code == 400
+
+
 @pytest.mark.parametrize("path", ("/create", "/1/update", "/1/delete"))
 def test_login_required(client, path):
     response = client.post(path)
@@ -54,6 +118,44 @@ def test_create(client, auth, app):
         assert count == 2
 
 
+def test_create_excerpt(client, auth, app):
+    app.config["EXCERPT_LENGTH"] = 10
+    auth.login()
+    client.post("/create", data={"title": "long", "body": "first second third"})
+
+    with app.app_context():
+        post = get_db().execute("SELECT excerpt, body FROM post WHERE id = 2").fetchone()
+        assert post["excerpt"] == "first…"
+        assert post["body"] == "first second third"
+
+    # the index only shows the excerpt, the post's page shows everything
+    assert b"second" not in client.get("/").data
+    assert b"first second third" in client.get("/2").data
+
+
+@pytest.mark.parametrize(
+    ("body", "excerpt"),
+    (
+        ("short", "short"),
+        ("one two three", "one two…"),
+        ("one two  three", "one two…"),
+        ("onetwothree", "onetwoth…"),
+    ),
+)
+def test_make_excerpt(body, excerpt):
+    assert make_excerpt(body, 8) == excerpt
+
+
+def test_detail(client, auth):
+    response = client.get("/1")
+    assert b"test\nbody" in response.data
+    assert b'href="/1/update"' not in response.data
+
+    auth.login()
+    assert b'href="/1/update"' in client.get("/1").data
+    assert client.get("/2").status_code == 404
+
+
 def test_update(client, auth, app):
     auth.login()
     assert client.get("/1/update").status_code == 200
@@ -63,6 +165,9 @@ def test_update(client, auth, app):
         db = get_db()
         post = db.execute("SELECT * FROM post WHERE id = 1").fetchone()
         assert post["title"] == "updated"
+        assert post["excerpt"] == ""
+        assert post["version"] == 1
+        assert post["updated_at"] is not None
 
 
 @pytest.mark.parametrize("path", ("/create", "/1/update"))
@@ -81,3 +186,95 @@ def test_delete(client, auth, app):
         db = get_db()
         post = db.execute("SELECT * FROM post WHERE id = 1").fetchone()
         assert post is None
+
+
+def test_author(client, auth, app):
+    app.config["POSTS_PER_PAGE"] = 1
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            "INSERT INTO post (title, body, author_id, created_at)"
+            " VALUES ('second', '', 1, '2023-01-02 00:00:00'), ('by other', '', 2, '2023-01-03 00:00:00')"
+        )
+        db.commit()
+
+    response = client.get("/author/test")
+    assert b"Posts by test" in response.data
+    assert b"2 posts" in response.data
+    assert b"second" in response.data
+    assert b"by other" not in response.data
+    assert b'href="/author/test?before=2023-01-02+00:00:00,2"' in response.data
+
+    response = client.get("/author/test", query_string={"before": "2023-01-02 00:00:00,2"})
+    assert b"test title" in response.data
+    assert b"Older" not in response.data
+
+    assert client.get("/author/nobody").status_code == 404
+
+
+def test_author_post_count(client, auth, app):
+    auth.login()
+    assert b"1 post<" in client.get("/author/test").data
+
+    # the cached page follows new and deleted posts
+    client.post("/create", data={"title": "created", "body": ""})
+    assert b"2 posts" in client.get("/author/test").data
+    client.post("/1/delete")
+    client.post("/2/delete")
+    assert b"0 posts" in client.get("/author/test").data
+
+    # moving a post to another author moves the count too
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO post (title, body, author_id) VALUES ('moved', '', 1)")
+        db.execute("UPDATE post SET author_id = 2 WHERE title = 'moved'")
+        db.commit()
+        counts = db.execute("SELECT username, post_count FROM user ORDER BY id").fetchall()
+        assert [tuple(row) for row in counts] == [("test", 0), ("other", 1)]
+
+
+def test_search(client, auth, app):
+    response = client.get("/search", query_string={"q": "body"})
+    assert b"test title" in response.data
+    assert b"<mark>body</mark>" in response.data
+
+    assert b"No posts match" in client.get("/search", query_string={"q": "nothing"}).data
+
+    # the index follows created, updated and deleted posts
+    auth.login()
+    client.post("/create", data={"title": "<b>unique</b>", "body": "words"})
+    response = client.get("/search", query_string={"q": "unique"})
+    assert b"&lt;b&gt;<mark>unique</mark>&lt;/b&gt;" in response.data
+
+    client.post("/1/update", data={"title": "renamed", "body": ""})
+    assert b"No posts match" in client.get("/search", query_string={"q": "body"}).data
+
+    client.post("/2/delete")
+    assert b"No posts match" in client.get("/search", query_string={"q": "unique"}).data
+
+
+@pytest.mark.parametrize("q", ('"', "AND", "title*", "NEAR("))
+def test_search_quotes_input(client, q):
+    assert client.get("/search", query_string={"q": q}).status_code == 200
+
+
+def test_search_pages(client, app):
+    app.config["POSTS_PER_PAGE"] = 1
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO post (title, body, author_id) VALUES ('body body', '', 1)")
+        db.commit()
+
+    # the better match comes first
+    response = client.get("/search", query_string={"q": "body"})
+    assert b"<mark>body</mark> <mark>body</mark>" in response.data
+    assert b"Next" in response.data
+
+    response = client.get("/search", query_string={"q": "body", "page": 2})
+    assert b"test title" in response.data
+    assert b"Next" not in response.data and b"Previous" in response.data
+
+    # the pages stop at SEARCH_MAX_PAGES
+    app.config["SEARCH_MAX_PAGES"] = 1
+    assert b"Next" not in client.get("/search", query_string={"q": "body"}).data
+    assert client.get("/search", query_string={"q": "body", "page": 2}).status_code == 400
@@ -0,0 +1,80 @@
+import json
+
+import click
+import pytest
+
+from flaskr.bulk import batched, import_posts
+from flaskr.db import get_db
+
+
+def test_batched():
+    assert list(batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(batched([], 2)) == []
+
+
+@pytest.mark.parametrize("name", ("posts.jsonl", "posts.csv"))
+def test_export_import(runner, app, tmp_path, name):
+    path = str(tmp_path / name)
+    result = runner.invoke(args=["export-posts", path])
+    assert "Exported 1 posts" in result.output
+
+    # importing the export again duplicates the post exactly
+    result = runner.invoke(args=["import-posts", path])
+    assert "Imported 1 posts" in result.output
+
+    with app.app_context():
+        posts = get_db().execute(
+            "SELECT title, body, author_id, created_at FROM post"
+        ).fetchall()
+        assert len(posts) == 2
+        assert tuple(posts[0]) == tuple(posts[1])
+
+
+def test_import_batches(runner, app):
+    lines = "\n".join(
+        json.dumps({"title": f"post {n}", "body": "", "author": "other"}) for n in range(5)
+    )
+    result = runner.invoke(args=["import-posts", "--batch-size", "2"], input=lines)
+    assert "2 posts imported" in result.output
+    assert "4 posts imported" in result.output
+    assert "Imported 5 posts" in result.output
+
+    with app.app_context():
+        db = get_db()
+        assert db.execute("SELECT COUNT(*) FROM post WHERE author_id = 2").fetchone()[0] == 5
+
+
+def test_import_unknown_author(app):
+    with app.app_context():
+        posts = [(1, {"title": "a", "author": "test"}), (2, {"title": "b", "author": "nobody"})]
+        with pytest.raises(click.ClickException, match="line 2: unknown author 'nobody'"):
+            import_posts(posts, batch_size=1)
+
+        # the batch before the bad post was kept
+        assert get_db().execute("SELECT COUNT(*) FROM post").fetchone()[0] == 2
+
+
+@pytest.mark.parametrize(("line", "message"), (
+    ('{"title": "no author"}', "line 3: author is required."),
+    ('["not", "a", "post"]', "line 3: expected an object"),
+    ('{"title": "a", "author": "test", "body": 1}', "line 3: body must be text."),
+    ('{"title": "a", "author": "test", "created_at": "yesterday"}', "line 3: invalid created_at 'yesterday'."),
+    ('{"title": ', "line 3: Expecting value"),
+))
+def test_import_bad_line(runner, app, line, message):
+    lines = '{"title": "fine", "author": "test"}\n\n' + line + "\n"
+    result = runner.invoke(args=["import-posts", "--batch-size", "1"], input=lines)
+    assert result.exit_code == 1
+    assert message in result.output
+    assert "Traceback" not in result.output
+
+    # the post before the bad line was kept
+    with app.app_context():
+        assert get_db().execute("SELECT COUNT(*) FROM post").fetchone()[0] == 2
+
+
+def test_import_csv_line_numbers(app, tmp_path):
+    path = tmp_path / "posts.csv"
+    path.write_text("title,body,author,created_at\nfine,,test,\n,,test,\n")
+    result = app.test_cli_runner().invoke(args=["import-posts", str(path)])
+    assert "line 3: title is required." in result.output
@@ -0,0 +1,154 @@
+from flask import template_rendered
+
+from flaskr.cache import LRUCache, get_page_cache, get_fragment_cache
+from flaskr.db import get_db
+
+
+def test_lru_eviction():
+    cache = LRUCache(max_size=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+
+    # 'b' is now the least recently used entry
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_lru_timeout(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('flaskr.cache.time.monotonic', lambda: now[0])
+    cache = LRUCache(timeout=10)
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+
+    now[0] += 11
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_lru_invalidate():
+    cache = LRUCache()
+    cache.set('a', 1, tags=('post:1', 'latest'))
+    cache.set('b', 2, tags=('post:2',))
+    cache.invalidate('latest')
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+
+
+def test_lru_stale_set():
+    cache = LRUCache()
+    since = cache.generation()
+    # a writer invalidates the post while the value is being made from the old row
+    cache.invalidate('post:1')
+    cache.set('a', 'old', tags=('post:1',), since=since)
+    cache.set('b', 'other', tags=('post:2',), since=since)
+    assert cache.get('a') is None
+    assert cache.get('b') == 'other'
+
+    cache.set('a', 'new', tags=('post:1',), since=cache.generation())
+    assert cache.get('a') == 'new'
+
+
+def test_index_cached(client, app):
+    assert client.get('/').headers['X-Cache'] == 'MISS'
+
+    # a second visit doesn't read the posts or their authors again
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE user SET username = 'stale' WHERE id = 1")
+        db.commit()
+
+    response = client.get('/')
+    assert response.headers['X-Cache'] == 'HIT'
+    assert b'by test' in response.data
+    assert get_page_cache(app).hits == 1
+
+
+def test_index_cache_sees_other_processes(client, app):
+    client.get('/')
+
+    # another worker edits the post, this process's cache never hears of it
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET title = 'edited', version = version + 1 WHERE id = 1")
+        db.commit()
+
+    response = client.get('/')
+    assert response.headers['X-Cache'] == 'MISS'
+    assert b'edited' in response.data
+
+
+def test_index_cache_per_user(client, auth):
+    client.get('/')
+    auth.login()
+    response = client.get('/')
+    assert response.headers['X-Cache'] == 'MISS'
+    assert b'href="/1/update"' in response.data
+
+
+def test_index_cache_invalidated(client, auth):
+    auth.login()
+    client.get('/')
+
+    client.post('/create', data={'title': 'created', 'body': ''})
+    response = client.get('/')
+    assert response.headers['X-Cache'] == 'MISS'
+    assert b'created' in response.data
+
+    client.post('/1/update', data={'title': 'updated', 'body': ''})
+    assert b'updated' in client.get('/').data
+
+    client.post('/1/delete')
+    assert b'updated' not in client.get('/').data
+
+
+def test_index_cache_disabled(client, app):
+    app.config['PAGE_CACHE_SIZE'] = 0
+    client.get('/')
+    assert client.get('/').headers['X-Cache'] == 'MISS'
+
+
+def test_fragments_shared_between_users(client, auth, app):
+    client.get('/')
+    auth.login()
+    response = client.get('/')
+
+    # the page differs for the author, but the article itself is reused
+    assert response.headers['X-Cache'] == 'MISS'
+    assert get_fragment_cache(app).hits == 1
+    assert b'href="/1/update"' in response.data
+    assert b'test title' in response.data
+
+
+def test_fragments_versioned(client, app):
+    client.get('/')
+
+    # an edit made by another process only shows once its version changes
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET title = 'stale' WHERE id = 1")
+        db.commit()
+    get_page_cache(app).clear()
+    assert b'test title' in client.get('/').data
+
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET title = 'edited', version = version + 1 WHERE id = 1")
+        db.commit()
+    get_page_cache(app).clear()
+    assert b'edited' in client.get('/').data
+
+
+def test_fragments_not_timed_as_pages(client, app):
+    rendered = []
+
+    def record(sender, template, context, **extra):
+        rendered.append(template.name)
+
+    # the page timer covers the whole page, fragments and all
+    with template_rendered.connected_to(record, app):
+        client.get('/')
+    assert rendered == ['blog/index.html']
@@ -0,0 +1,78 @@
+import gzip
+
+import pytest
+
+from flaskr import create_app
+from flaskr.db import get_db
+
+
+@pytest.fixture
+def compressed(app):
+    app = create_app({
+        "TESTING": True,
+        "DATABASE": app.config["DATABASE"],
+        "TEMPLATE_CACHE_DIR": None,
+        "ASSETS_DIR": None,
+        "JOB_WORKERS": 0,
+        "COMPRESS": True,
+        "COMPRESS_MIN_SIZE": 100,
+    })
+    return app
+
+
+def test_off_by_default(client):
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+
+
+def test_compress(compressed):
+    client = compressed.test_client()
+    plain = client.get("/")
+    assert "Content-Encoding" not in plain.headers
+    assert "Accept-Encoding" in plain.headers["Vary"]
+
+    response = client.get("/", headers={"Accept-Encoding": "gzip, deflate"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert int(response.headers["Content-Length"]) < len(plain.data)
+    assert gzip.decompress(response.data) == plain.data
+
+
+def test_small_responses(compressed):
+    response = compressed.test_client().get("/hello", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+    assert response.data == b"Hello, world!"
+
+
+def test_skip_files(compressed):
+    response = compressed.test_client().get("/static/style.css", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+
+
+def test_compress_stream(compressed):
+    compressed.config["STREAM_TEMPLATES"] = True
+    with compressed.app_context():
+        db = get_db()
+        db.executemany(
+            "INSERT INTO post (title, excerpt, body, author_id) VALUES (?, ?, '', 1)",
+            [(f"post {n}", "x" * 200) for n in range(20)],
+        )
+        db.commit()
+
+    client = compressed.test_client()
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert response.is_streamed
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in response.headers
+    assert gzip.decompress(response.data) == client.get("/").data
+
+
+def test_compressed_etag(compressed):
+    client = compressed.test_client()
+    response = client.get("/api/posts", headers={"Accept-Encoding": "gzip"})
+    etag = response.headers["ETag"]
+    assert etag.endswith('-gzip"')
+
+    # the compressed ETag is recognised when it comes back
+    response = client.get("/api/posts", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
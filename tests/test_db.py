@@ -1,8 +1,16 @@
 import sqlite3
+import threading
+from datetime import datetime
 
+import click
 import pytest
+from flask import g
 
-from flaskr.db import get_db
+from flaskr.db import (
+    get_db, get_read_db, get_pool, close_pool, get_writer, write, WriteCoordinator, timestamp, to_datetime, upgrade_db, backfill
+)
+from flaskr.migrations import MIGRATIONS
+from flaskr.queries import explain
 
 
 def test_get_close_db(app):
@@ -10,11 +18,64 @@ def test_get_close_db(app):
         db = get_db()
         assert db is get_db()
 
+    # the connection goes back to the pool and is reused by the next context
+    with app.app_context():
+        assert get_db() is db
+
+    close_pool(app)
+
     with pytest.raises(sqlite3.ProgrammingError) as e:
         db.execute('SELECT 1')
 
     assert 'closed' in str(e.value)
 
+
+def test_connection_pragmas(app):
+    app.config['DATABASE_CACHE_SIZE'] = -1234
+    app.config['DATABASE_BUSY_TIMEOUT'] = 4321
+    close_pool(app)
+
+    with app.app_context():
+        db = get_db()
+        assert db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert db.execute('PRAGMA synchronous').fetchone()[0] == 1
+        assert db.execute('PRAGMA cache_size').fetchone()[0] == -1234
+        assert db.execute('PRAGMA busy_timeout').fetchone()[0] == 4321
+
+
+def test_pool_resets_connections(app):
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET title = 'uncommitted'")
+
+    # the open transaction was rolled back when the connection went back, so the write lock is free
+    assert not db.in_transaction
+    with app.app_context():
+        write("UPDATE post SET title = 'written'")
+        assert get_db().execute('SELECT title FROM post').fetchone()[0] == 'written'
+
+    # a broken connection is replaced
+    db.close()
+    with app.app_context():
+        assert get_db() is not db
+        assert get_db().execute('SELECT 1').fetchone()[0] == 1
+
+
+def test_pool_max_size(app):
+    app.config['DATABASE_POOL_SIZE'] = 1
+    close_pool(app)
+    pool = get_pool(app)
+
+    first, second = pool.acquire(), pool.acquire()
+    pool.release(first)
+    pool.release(second)
+
+    # only one idle connection is kept, the other one is closed
+    assert pool.acquire() is first
+    pool.release(first)
+    with pytest.raises(sqlite3.ProgrammingError):
+        second.execute('SELECT 1')
+
     '''
     The init-db command should call the init_db function and output a message.
     '''
@@ -36,3 +97,242 @@ def test_init_db_command(runner, monkeypatch):
     This tests uses Pytest’s monkeypatch fixture to replace the init_db function with one that records that it’s been called. 
     The runner fixture you wrote above is used to call the init-db command by name.
     '''
+
+
+def test_rebuild_search_index(app, runner):
+    with app.app_context():
+        db = get_db()
+        db.execute('DROP TABLE post_fts')
+        db.commit()
+
+    result = runner.invoke(args=['rebuild-search'])
+    assert 'Rebuilt' in result.output
+
+    with app.app_context():
+        assert get_db().execute(
+            "SELECT rowid FROM post_fts WHERE post_fts MATCH 'body'"
+        ).fetchone()[0] == 1
+
+
+def test_write_group_commit(app):
+    app.config['WRITE_GROUP_WINDOW'] = 0.05
+    writer = get_writer(app)
+    errors = []
+
+    def insert(n):
+        with app.app_context():
+            try:
+                write('INSERT INTO user (username, password) VALUES (?, ?)', (f'user{n}', ''))
+            except sqlite3.Error as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=insert, args=(n % 10,)) for n in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # the duplicates failed one by one, without undoing the other writes in their group
+    assert len(errors) == 10
+    assert all(isinstance(e, sqlite3.IntegrityError) for e in errors)
+    assert writer.writes == 20
+    assert writer.groups < 20
+
+    with app.app_context():
+        assert get_db().execute('SELECT COUNT(*) FROM user').fetchone()[0] == 12
+
+
+def test_writer_failures(app):
+    def broken():
+        raise sqlite3.OperationalError('unable to open database file')
+
+    # a writer that can't connect fails the write instead of leaving it waiting
+    writer = WriteCoordinator(broken)
+    with pytest.raises(sqlite3.OperationalError, match='unable to open'):
+        writer.submit('SELECT 1')
+
+    # a write that isn't committed in time gives up
+    writer = WriteCoordinator(get_pool(app).connect, window=5, timeout=0.1)
+    with pytest.raises(sqlite3.OperationalError, match='did not answer'):
+        writer.submit("INSERT INTO post (title, body, author_id) VALUES ('a', '', 1)")
+    writer.close()
+
+
+def test_write_returns_lastrowid(app):
+    with app.app_context():
+        assert write("INSERT INTO post (title, body, author_id) VALUES ('a', '', 1)") == 2
+
+
+def test_write_without_writer(app):
+    app.config['WRITE_GROUP_SIZE'] = 1
+
+    with app.app_context():
+        assert write("INSERT INTO post (title, body, author_id) VALUES ('a', '', 1)") == 2
+        with pytest.raises(sqlite3.IntegrityError):
+            write("INSERT INTO user (username, password) VALUES ('test', '')")
+
+    assert 'flaskr.writer' not in app.extensions
+
+
+def test_read_db(app):
+    with app.app_context():
+        db = get_read_db()
+        assert db is get_read_db()
+        assert db is not get_db()
+
+        with pytest.raises(sqlite3.OperationalError):
+            db.execute("UPDATE post SET title = 'changed'")
+
+        # readers go on while another connection holds the write lock
+        get_db().execute('BEGIN IMMEDIATE')
+        get_db().execute("UPDATE post SET title = 'changed'")
+        assert db.execute('SELECT title FROM post').fetchone()[0] == 'test title'
+        get_db().rollback()
+
+    # read connections are pooled as well
+    with app.app_context():
+        assert get_read_db() is db
+
+
+def test_records(app):
+    with app.app_context():
+        post = get_read_db().execute('SELECT id, title, created_at FROM post').fetchone()
+
+    assert isinstance(post, tuple)
+    assert post.keys() == ['id', 'title', 'created_at']
+    assert post['title'] == post[1] == 'test title'
+    # timestamps are only parsed when read by name
+    assert post[2] == post.raw('created_at') == '2023-01-01 00:00:00'
+    assert post['created_at'] == datetime(2023, 1, 1)
+
+    with pytest.raises(IndexError):
+        post['body']
+
+
+def test_to_datetime():
+    assert to_datetime('2023-01-01 00:00:00') == datetime(2023, 1, 1)
+    assert to_datetime(1672531200) == datetime(2023, 1, 1)
+    assert to_datetime(None) is None
+
+
+def test_epoch_timestamps(app, client, runner):
+    app.config['EPOCH_TIMESTAMPS'] = True
+    result = runner.invoke(args=['convert-timestamps'])
+    assert 'Converted 1 timestamps' in result.output
+
+    with app.app_context():
+        db = get_db()
+        assert db.execute('SELECT created_at FROM post').fetchone()[0] == 1672531200
+        assert timestamp('2023-01-02 00:00:00') == 1672617600
+        db.executemany(
+            'INSERT INTO post (title, body, author_id, created_at) VALUES (?, ?, 1, ?)',
+            [(f'post {n}', '', timestamp(f'2023-01-0{n} 00:00:00')) for n in range(2, 4)],
+        )
+        db.commit()
+
+    # the cursors compare epoch seconds with the index
+    app.config['POSTS_PER_PAGE'] = 2
+    response = client.get('/')
+    assert b'on 2023-01-03' in response.data and b'test title' not in response.data
+    assert b'before=1672617600,2' in response.data
+    response = client.get('/', query_string={'before': '1672617600,2'})
+    assert b'test title' in response.data and b'post 2' not in response.data
+
+    app.config['EPOCH_TIMESTAMPS'] = False
+    runner.invoke(args=['convert-timestamps'])
+    with app.app_context():
+        assert get_db().execute('SELECT created_at FROM post WHERE id = 1').fetchone()[0] == '2023-01-01 00:00:00'
+
+
+# the tables as the first version of schema.sql created them
+OLD_SCHEMA = """
+DROP TABLE IF EXISTS post_fts;
+DROP TABLE IF EXISTS user;
+DROP TABLE IF EXISTS post;
+CREATE TABLE user (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL, password TEXT NOT NULL);
+CREATE TABLE post (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    author_id INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    title TEXT NOT NULL,
+    body TEXT NOT NULL
+);
+PRAGMA user_version = 0;
+"""
+
+
+def test_init_db_version(app):
+    with app.app_context():
+        assert get_db().execute('PRAGMA user_version').fetchone()[0] == len(MIGRATIONS)
+        assert upgrade_db() == len(MIGRATIONS)
+
+
+def test_upgrade_db(app, runner):
+    app.config['EXCERPT_LENGTH'] = 10
+    with app.app_context():
+        db = get_db()
+        db.executescript(OLD_SCHEMA)
+        db.execute("INSERT INTO user (username, password) VALUES ('test', 'x')")
+        db.executemany(
+            'INSERT INTO post (title, body, author_id) VALUES (?, ?, 1)',
+            [(f'post {n}', f'body number {n}') for n in range(5)],
+        )
+        db.commit()
+
+    result = runner.invoke(args=['db-upgrade', '--batch-size', '2', '--pause', '0'])
+    assert 'Applying 2: post_excerpt' in result.output
+    assert f'at version {len(MIGRATIONS)}' in result.output
+
+    with app.app_context():
+        db = get_db()
+        assert db.execute('SELECT excerpt FROM post WHERE id = 1').fetchone()[0] == 'body…'
+        assert db.execute('SELECT post_count FROM user').fetchone()[0] == 5
+        assert db.execute("SELECT count(*) FROM post_fts WHERE post_fts MATCH 'number'").fetchone()[0] == 5
+        assert 'post_created_at_id' in explain(db, 'posts_latest')[0]
+
+        # the triggers keep the count from now on
+        db.execute("INSERT INTO post (title, body, author_id) VALUES ('new', '', 1)")
+        db.commit()
+        assert db.execute('SELECT post_count FROM user').fetchone()[0] == 6
+
+    # nothing left to do
+    result = runner.invoke(args=['db-upgrade'])
+    assert 'Applying' not in result.output
+
+
+def test_upgrade_db_partly(app):
+    with app.app_context():
+        db = get_db()
+        db.executescript(OLD_SCHEMA)
+        assert upgrade_db(target=2) == 2
+        assert db.execute('PRAGMA user_version').fetchone()[0] == 2
+        assert 'excerpt' in [row[1] for row in db.execute('PRAGMA table_info(post)')]
+        assert 'post_count' not in [row[1] for row in db.execute('PRAGMA table_info(user)')]
+        assert upgrade_db() == len(MIGRATIONS)
+
+
+def test_backfill_batches(app):
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            "INSERT INTO post (title, body, author_id) VALUES ('x', '', 1)", [()] * 4
+        )
+        db.commit()
+        queries = len(g.get('queries', ()))
+        count = backfill(
+            'SELECT id FROM post WHERE id > ? ORDER BY id LIMIT ?',
+            'UPDATE post SET title = ? WHERE id = ?',
+            lambda row: (f'post {row[0]}', row[0]),
+            batch_size=2,
+        )
+        assert count == 5
+        assert db.execute('SELECT title FROM post WHERE id = 5').fetchone()[0] == 'post 5'
+        # two full batches, one with the fifth row and an empty one that ends the loop
+        assert sum(1 for q in g.queries[queries:] if q[0].startswith('SELECT id FROM post')) == 4
+
+
+def test_upgrade_db_newer(app):
+    with app.app_context():
+        get_db().execute('PRAGMA user_version = 1000')
+        with pytest.raises(click.ClickException):
+            upgrade_db()
@@ -1,3 +1,5 @@
+import pytest
+
 from flaskr import create_app
 
 
@@ -9,3 +11,10 @@ def test_config():
 def test_hello(client):
     response = client.get('/hello')
     assert response.data == b'Hello, world!'
+
+
+def test_old_sqlite(monkeypatch):
+    monkeypatch.setattr('flaskr.db.sqlite3.sqlite_version_info', (3, 31, 1))
+    monkeypatch.setattr('flaskr.db.sqlite3.sqlite_version', '3.31.1')
+    with pytest.raises(RuntimeError, match='needs SQLite 3.35.0 or newer, but Python uses SQLite 3.31.1'):
+        create_app({'TESTING': True})
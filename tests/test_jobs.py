@@ -0,0 +1,127 @@
+import threading
+import time
+
+import pytest
+from flask import g
+
+from flaskr.db import get_db
+from flaskr.jobs import job, enqueue, run_next, run_jobs, get_runner
+
+calls = []
+
+
+@job
+def remember(*args):
+    calls.append(args)
+
+
+@job
+def fail():
+    raise ValueError('no luck')
+
+
+@pytest.fixture(autouse=True)
+def clear_calls():
+    calls.clear()
+
+
+def jobs(app):
+    with app.app_context():
+        return get_db().execute('SELECT name, attempts, run_at, error FROM job').fetchall()
+
+
+def test_enqueue_and_run(app):
+    with app.app_context():
+        enqueue(remember, 1, 'two')
+        enqueue(remember, 3, delay=60)
+
+    assert len(jobs(app)) == 2
+    with app.app_context():
+        assert run_jobs() == 1
+
+    # the delayed job is still waiting
+    assert calls == [(1, 'two')]
+    assert [row['name'] for row in jobs(app)] == ['test_jobs.remember']
+
+
+def test_idle_poll_only_reads(app):
+    with app.app_context():
+        enqueue(remember, delay=60)
+        queries = len(g.queries)
+        assert not run_next()
+        # nothing was due, so the write lock was never taken
+        assert not any(sql.startswith('UPDATE job') for sql, seconds, rows in g.queries[queries:])
+
+
+def test_retry_with_backoff(app):
+    app.config.update(JOB_RETRY_DELAY=10, JOB_MAX_ATTEMPTS=2)
+    with app.app_context():
+        enqueue(fail)
+        assert run_next()
+        # not due again for JOB_RETRY_DELAY seconds
+        assert not run_next()
+
+    (name, attempts, run_at, error), = jobs(app)
+    assert attempts == 1
+    assert run_at == pytest.approx(time.time() + 10, abs=2)
+    assert error == "ValueError('no luck')"
+
+    with app.app_context():
+        get_db().execute('UPDATE job SET run_at = 0')
+        get_db().commit()
+        assert run_jobs() == 1
+
+    # out of attempts, the job is kept with its error but never taken again
+    (name, attempts, run_at, error), = jobs(app)
+    assert attempts == 2
+    assert run_at is None
+
+
+def test_timeout(app):
+    app.config['JOB_TIMEOUT'] = 60
+    with app.app_context():
+        enqueue(remember)
+        # a worker takes the job and dies before finishing it
+        get_db().execute('UPDATE job SET run_at = ?, attempts = 1', (time.time() + 60,))
+        get_db().commit()
+        assert run_jobs() == 0
+
+        get_db().execute('UPDATE job SET run_at = 0')
+        get_db().commit()
+        assert run_jobs() == 1
+
+    assert calls == [()]
+    assert jobs(app) == []
+
+
+def test_unknown_job(app):
+    with app.app_context():
+        get_db().execute("INSERT INTO job (name, run_at) VALUES ('nowhere.nothing', 0)")
+        get_db().commit()
+        assert run_jobs() == 1
+
+    assert "Unknown job 'nowhere.nothing'" in jobs(app)[0]['error']
+
+
+def test_runner_threads(app):
+    app.config.update(JOB_WORKERS=1, JOB_POLL_INTERVAL=60)
+    done = threading.Event()
+    get_runner(app).start()
+
+    @job
+    def signal():
+        done.set()
+
+    # enqueueing wakes the idle thread instead of waiting for its next poll
+    with app.app_context():
+        enqueue(signal)
+    assert done.wait(5)
+
+
+def test_worker_burst(app, runner):
+    with app.app_context():
+        enqueue(remember, 'burst')
+
+    result = runner.invoke(args=['worker', '--burst'])
+    assert 'Ran 1 jobs' in result.output
+    assert calls == [('burst',)]
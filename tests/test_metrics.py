@@ -0,0 +1,93 @@
+import logging
+
+from flask import g
+
+from flaskr import create_app
+from flaskr.db import get_read_db
+from flaskr.metrics import Metrics
+
+
+def test_server_timing(client):
+    timing = client.get("/").headers["Server-Timing"]
+    assert timing.startswith("db;dur=")
+    assert "tpl;dur=" in timing and "total;dur=" in timing
+
+
+def test_queries_recorded(client, auth):
+    auth.login()
+
+    with client:
+        client.get("/")
+        sql, seconds, rows = g.queries[-1]
+        assert "FROM post p JOIN user u" in sql
+        assert seconds > 0
+        assert rows == 1
+
+
+def test_query_timing_disabled(app):
+    app.config["QUERY_TIMING"] = False
+
+    # reads are still counted and timed, but their rows aren't
+    with app.app_context():
+        get_read_db().execute("SELECT * FROM post").fetchall()
+        (sql, seconds, rows), = g.queries
+        assert sql == "SELECT * FROM post"
+        assert seconds > 0
+        assert rows == 0
+
+
+def test_slow_query_log(client, app, caplog):
+    app.config["SLOW_QUERY_THRESHOLD"] = 0
+
+    with caplog.at_level(logging.WARNING):
+        client.get("/")
+
+    assert "Slow query" in caplog.text
+    assert "blog.index" in caplog.text
+
+
+def test_metrics_endpoint(client):
+    client.get("/")
+    client.get("/")
+    response = client.get("/metrics")
+    assert response.mimetype == "text/plain"
+
+    text = response.get_data(as_text=True)
+    assert 'flaskr_request_duration_seconds_count{endpoint="blog.index"} 2' in text
+    assert 'flaskr_request_duration_seconds_bucket{endpoint="blog.index",le="+Inf"} 2' in text
+    # the posts once, and the post_changes counter on both requests
+    assert 'flaskr_db_queries_total{endpoint="blog.index"} 3' in text
+    assert "flaskr_page_cache_hits_total 1" in text
+
+
+def test_metrics_access(client, app):
+    assert client.get("/metrics", environ_base={"REMOTE_ADDR": "10.0.0.1"}).status_code == 403
+
+    app.config["METRICS_TOKEN"] = "secret"
+    assert client.get("/metrics").status_code == 403
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 403
+    response = client.get("/metrics", headers={"Authorization": "Bearer secret"}, environ_base={"REMOTE_ADDR": "10.0.0.1"})
+    assert response.status_code == 200
+
+
+def test_metrics_disabled(tmp_path):
+    app = create_app({
+        "TESTING": True,
+        "METRICS": False,
+        "DATABASE": str(tmp_path / "flaskr.sqlite"),
+        "TEMPLATE_CACHE_DIR": None,
+        "ASSETS_DIR": None,
+        "JOB_WORKERS": 0,
+    })
+    assert app.test_client().get("/metrics").status_code == 404
+
+
+def test_histogram_buckets():
+    metrics = Metrics(buckets=(0.1, 1.0))
+    for seconds in (0.05, 0.5, 0.7, 5):
+        metrics.observe("e", seconds, [])
+
+    text = metrics.render()
+    assert 'flaskr_request_duration_seconds_bucket{endpoint="e",le="0.1"} 1' in text
+    assert 'flaskr_request_duration_seconds_bucket{endpoint="e",le="1.0"} 3' in text
+    assert 'flaskr_request_duration_seconds_bucket{endpoint="e",le="+Inf"} 4' in text
@@ -0,0 +1,47 @@
+import pytest
+
+from flaskr.db import get_db
+from flaskr.queries import SQL, check_plans, explain
+
+
+@pytest.fixture
+def large_db(app):
+    # enough rows that SQLite picks the plans it would pick in production
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            "INSERT INTO user (username, password) VALUES (?, '')",
+            ((f"user{n}",) for n in range(1000)),
+        )
+        db.executemany(
+            "INSERT INTO post (title, body, author_id, created_at) VALUES (?, '', ?, ?)",
+            ((f"post {n}", n % 1000 + 1, f"2023-01-01 00:00:{n % 60:02}") for n in range(20000)),
+        )
+        db.execute("ANALYZE")
+        db.commit()
+        yield db
+
+
+def test_query_plans(large_db):
+    assert check_plans(large_db) == []
+
+
+def test_check_plans_finds_scans(large_db, monkeypatch):
+    monkeypatch.setitem(SQL, "posts_by_title", "SELECT id FROM post WHERE title = ? ORDER BY body")
+    problems = check_plans(large_db)
+    assert "posts_by_title: SCAN post" in problems
+    assert any(p.startswith("posts_by_title: USE TEMP B-TREE") for p in problems)
+
+
+def test_explain(large_db):
+    assert explain(large_db, "post_by_id") == [
+        "SEARCH p USING INTEGER PRIMARY KEY (rowid=?)",
+        "SEARCH u USING INTEGER PRIMARY KEY (rowid=?)",
+    ]
+
+
+def test_check_plans_finds_unbounded_index_scans(large_db, monkeypatch):
+    # walking post_created_at_id is only cheap when a LIMIT stops it
+    monkeypatch.setitem(SQL, "posts_all", "SELECT p.id FROM post p ORDER BY p.created_at DESC, p.id DESC")
+    problems = check_plans(large_db)
+    assert any(p.startswith("posts_all: SCAN p USING") for p in problems)
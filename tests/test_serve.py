@@ -0,0 +1,104 @@
+import os
+import signal
+import socket
+import time
+import urllib.request
+
+import pytest
+
+from flaskr.serve import PreforkServer, run_worker
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork()")
+
+
+def get(port, path="/hello"):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=5) as response:
+        return response.status, response.read().decode()
+
+
+# Run a PreforkServer in a child process, so its signal handlers and workers stay out of pytest.
+def start(app, **kwargs):
+    server = PreforkServer(lambda: app, app, "127.0.0.1", 0, **kwargs)
+    port = server.sock.getsockname()[1]
+    pid = os.fork()
+
+    if pid == 0:
+        try:
+            server.run()
+        finally:
+            os._exit(0)
+
+    server.sock.close()
+    return pid, port
+
+
+def stop(pid):
+    os.kill(pid, signal.SIGTERM)
+    return os.waitpid(pid, 0)[1]
+
+
+def test_serve(app):
+    pid, port = start(app, workers=2)
+
+    try:
+        for _ in range(10):
+            assert get(port) == (200, "Hello, world!")
+        status, body = get(port, "/")
+        assert status == 200
+        assert "test title" in body
+    finally:
+        assert stop(pid) == 0
+
+
+def test_max_requests(app):
+    pid, port = start(app, workers=1, max_requests=2)
+
+    try:
+        for _ in range(5):
+            assert get(port)[0] == 200
+        # the fifth request went to the third worker, and /metrics is its second
+        body = get(port, "/metrics")[1]
+        assert 'flaskr_request_duration_seconds_count{endpoint="hello"} 1' in body
+    finally:
+        assert stop(pid) == 0
+
+
+def test_reload(app):
+    pid, port = start(app, workers=2)
+
+    try:
+        assert get(port)[0] == 200
+        os.kill(pid, signal.SIGHUP)
+        for _ in range(10):
+            assert get(port)[0] == 200
+            time.sleep(0.02)
+    finally:
+        assert stop(pid) == 0
+
+
+def test_worker_ignores_hangup(app):
+    sock = socket.create_server(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    pid = os.fork()
+
+    if pid == 0:
+        try:
+            run_worker(app, sock, max_requests=2)
+        finally:
+            os._exit(0)
+
+    try:
+        # the first request shows the worker's signal handlers are in place
+        assert get(port)[0] == 200
+        # e.g. kill -HUP -<pgid>, which reaches the workers as well as the master
+        os.kill(pid, signal.SIGHUP)
+        assert get(port)[0] == 200
+    finally:
+        sock.close()
+        assert os.waitpid(pid, 0)[1] == 0
+
+
+def test_serve_command_options(runner):
+    result = runner.invoke(args=["serve", "--help"])
+    assert "--workers" in result.output
+    assert "--max-requests" in result.output
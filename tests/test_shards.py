@@ -0,0 +1,240 @@
+import os
+
+import pytest
+
+from flaskr import create_app
+from flaskr.blog import insert_post
+from flaskr.db import (
+    get_db, get_shard_db, init_db, close_pool, shard_path, shards_for_post, upgrade_db, SHARD_ID_BITS
+)
+from flaskr.migrations import MIGRATIONS, post_updated_at
+
+with open(os.path.join(os.path.dirname(__file__), "data.sql"), "rb") as f:
+    _data_sql = f.read().decode("utf8")
+
+
+@pytest.fixture
+def sharded(tmp_path):
+    app = create_app({
+        "TESTING": True,
+        "DATABASE": str(tmp_path / "flaskr.sqlite"),
+        "PASSWORD_HASH_METHOD": "pbkdf2:sha256:50000",
+        "TEMPLATE_CACHE_DIR": None,
+        "ASSETS_DIR": None,
+        "DATABASE_SHARDS": 2,
+        "PAGE_CACHE_SIZE": 0,
+        "JOB_WORKERS": 0,
+    })
+
+    # the test data goes into the main database, and is moved to its shard like after turning sharding on
+    with app.app_context():
+        init_db()
+        get_db().executescript(_data_sql)
+    result = app.test_cli_runner().invoke(args=["rebalance-shards"])
+    assert "Moved 1 posts" in result.output
+
+    yield app
+
+    close_pool(app)
+
+
+@pytest.fixture
+def client(sharded):
+    return sharded.test_client()
+
+
+# Log in as one of the users from data.sql, whose passwords are their usernames.
+def login(client, username):
+    client.post("/auth/login", data={"username": username, "password": username})
+
+
+def count(app, shard, sql="SELECT count(*) FROM post"):
+    with app.app_context():
+        return get_shard_db(shard).execute(sql).fetchone()[0]
+
+
+def test_shard_files(sharded):
+    assert os.path.exists(shard_path(sharded, 0))
+    assert os.path.exists(shard_path(sharded, 1))
+    # the test user has id 1, so their posts are on shard 1
+    assert count(sharded, None) == 0
+    assert count(sharded, 0) == 0
+    assert count(sharded, 1) == 1
+
+
+def test_create_routes_by_author(sharded, client):
+    login(client, "other")
+    client.post("/create", data={"title": "other post", "body": "on shard 0"})
+    login(client, "test")
+    client.post("/create", data={"title": "test post", "body": "on shard 1"})
+
+    assert count(sharded, 0) == 1
+    assert count(sharded, 1) == 2
+    # ids say which shard a post was created on
+    with sharded.app_context():
+        assert shards_for_post((1 << SHARD_ID_BITS) + 1) == [0, 1]
+        assert get_db().execute("SELECT post_count FROM user ORDER BY id").fetchall() == [(2,), (1,)]
+
+
+def test_index_merges_shards(sharded, client):
+    sharded.config["POSTS_PER_PAGE"] = 2
+    with sharded.app_context():
+        for shard, author_id, title, day in ((0, 2, "first", 2), (1, 1, "second", 3), (0, 2, "third", 4)):
+            db = get_shard_db(shard)
+            db.execute(
+                "INSERT INTO post (title, body, author_id, created_at) VALUES (?, '', ?, ?)",
+                (title, author_id, f"2023-01-0{day} 00:00:00"),
+            )
+            db.commit()
+
+    page = client.get("/").data
+    assert page.index(b"third") < page.index(b"second")
+    assert b"first" not in page and b"test title" not in page
+
+    # the next page goes on from the last post of the first one, whichever shard it is on
+    page = client.get("/", query_string={"before": f"2023-01-03 00:00:00,{(2 << SHARD_ID_BITS) + 1}"}).data
+    assert page.index(b"first") < page.index(b"test title")
+    assert b"Older" not in page
+
+
+def test_post_views(sharded, client):
+    login(client, "test")
+
+    assert b"test\nbody" in client.get("/1").data
+    client.post("/1/update", data={"title": "updated", "body": "new body"})
+    assert count(sharded, 1, "SELECT title FROM post WHERE id = 1") == "updated"
+
+    client.post("/1/delete")
+    assert count(sharded, 1) == 0
+    assert client.get("/1").status_code == 404
+    with sharded.app_context():
+        assert get_db().execute("SELECT post_count FROM user WHERE id = 1").fetchone()[0] == 0
+
+
+def test_author_and_search(sharded, client):
+    login(client, "other")
+    client.post("/create", data={"title": "other body", "body": "body of other"})
+
+    assert b"other body" in client.get("/author/other").data
+    assert b"test title" not in client.get("/author/other").data
+
+    page = client.get("/search?q=body").data
+    assert b"test title" in page and b"other" in page
+
+
+def test_rebalance_back(sharded, client):
+    login(client, "other")
+    client.post("/create", data={"title": "other post", "body": ""})
+
+    sharded.config["DATABASE_SHARDS"] = 1
+    result = sharded.test_cli_runner().invoke(args=["rebalance-shards", "--batch-size", "1"])
+    assert "Moved 2 posts" in result.output
+    assert count(sharded, None) == 2
+    assert count(sharded, 0) == count(sharded, 1) == 0
+
+    page = client.get("/").data
+    assert b"test title" in page and b"other post" in page
+    with sharded.app_context():
+        assert get_db().execute("SELECT post_count FROM user ORDER BY id").fetchall() == [(1,), (1,)]
+
+
+def test_rebalance_keeps_ids_unique(sharded):
+    with sharded.app_context():
+        get_db().execute("INSERT INTO user (username, password) VALUES ('third', '')")
+        get_db().commit()
+        # created on shard 1 with two shards, and moved to shard 0 with three
+        insert_post("third post", "", 3)
+
+    sharded.config["DATABASE_SHARDS"] = 3
+    result = sharded.test_cli_runner().invoke(args=["rebalance-shards"])
+    assert "Moved 1 posts" in result.output
+
+    with sharded.app_context():
+        ids = [insert_post("new", "", author_id) for author_id in (1, 2, 3)]
+        assert len(set(ids)) == 3
+        assert [shards_for_post(id)[0] for id in ids] == [1, 2, 0]
+
+
+def test_export_import(sharded, tmp_path):
+    runner = sharded.test_cli_runner()
+    path = str(tmp_path / "posts.jsonl")
+    assert "Exported 1 posts" in runner.invoke(args=["export-posts", path]).output
+
+    lines = '{"title": "other", "author": "other"}\n'
+    assert "Imported 1 posts" in runner.invoke(args=["import-posts"], input=lines).output
+    assert "Imported 1 posts" in runner.invoke(args=["import-posts", path]).output
+
+    assert count(sharded, 0) == 1
+    assert count(sharded, 1) == 2
+    assert count(sharded, None, "SELECT post_count FROM user ORDER BY id") == 2
+    assert count(sharded, None, "SELECT post_count FROM user WHERE id = 2") == 1
+
+
+def test_upgrade_sharded(sharded):
+    # sharding was raised to three shards, and the database is from before post.updated_at
+    sharded.config["DATABASE_SHARDS"] = 3
+    with sharded.app_context():
+        for shard in (None, 0, 1):
+            db = get_shard_db(shard)
+            db.execute("ALTER TABLE main.post DROP COLUMN updated_at")
+            db.commit()
+        get_db().execute(f"PRAGMA user_version = {MIGRATIONS.index(post_updated_at)}")
+
+        assert upgrade_db() == len(MIGRATIONS)
+
+        for shard in (None, 0, 1, 2):
+            columns = [row[1] for row in get_shard_db(shard).execute("PRAGMA main.table_info(post)")]
+            assert "updated_at" in columns
+
+
+def test_rebalance_keeps_colliding_posts(sharded):
+    with sharded.app_context():
+        # a post waiting in the main database, and a different post with its id on the shard it belongs on
+        for shard, created_at in ((None, "2023-01-01 00:00:00"), (0, "2024-01-01 00:00:00")):
+            db = get_shard_db(shard)
+            db.execute(
+                "INSERT INTO post (id, title, body, author_id, created_at) VALUES (7, ?, '', 2, ?)",
+                (f"post {created_at}", created_at),
+            )
+            db.commit()
+
+    result = sharded.test_cli_runner().invoke(args=["rebalance-shards"])
+    assert "Posts 7 were left where they are" in result.output
+    assert count(sharded, None, "SELECT created_at FROM post WHERE id = 7") == "2023-01-01 00:00:00"
+    assert count(sharded, 0, "SELECT created_at FROM post WHERE id = 7") == "2024-01-01 00:00:00"
+
+
+def test_reads_before_rebalance(tmp_path):
+    def make_app(shards):
+        return create_app({
+            "TESTING": True,
+            "DATABASE": str(tmp_path / "flaskr.sqlite"),
+            "TEMPLATE_CACHE_DIR": None,
+            "ASSETS_DIR": None,
+            "DATABASE_SHARDS": shards,
+            "JOB_WORKERS": 0,
+        })
+
+    app = make_app(1)
+    with app.app_context():
+        init_db()
+        get_db().executescript(_data_sql)
+    close_pool(app)
+
+    # sharding is turned on, and the test post is still in the main database
+    app = make_app(2)
+    assert os.path.exists(shard_path(app, 0)) and os.path.exists(shard_path(app, 1))
+    client = app.test_client()
+    assert b"test\nbody" in client.get("/1").data
+    assert b"test title" in client.get("/").data
+    assert b"test title" in client.get("/author/test").data
+    assert app.test_cli_runner().invoke(args=["rebalance-shards"]).output == "Moved 1 posts\n"
+    close_pool(app)
+
+    # and turned off again, with the post on a shard that was dropped
+    app = make_app(1)
+    client = app.test_client()
+    assert b"test\nbody" in client.get("/1").data
+    assert b"test title" in client.get("/").data
+    assert b"<mark>test</mark>\nbody" in client.get("/search?q=test").data
+    close_pool(app)
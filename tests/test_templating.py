@@ -0,0 +1,51 @@
+import os
+
+from flaskr import create_app
+from flaskr.db import get_pool, close_pool
+from flaskr.templating import warm_up
+
+
+def test_compile_templates(app, tmp_path):
+    cache_dir = tmp_path / "jinja"
+    app = create_app({
+        "TESTING": True,
+        "DATABASE": app.config["DATABASE"],
+        "TEMPLATE_CACHE_DIR": str(cache_dir),
+        "JOB_WORKERS": 0,
+    })
+    # creating the app doesn't write anything yet
+    assert not cache_dir.exists()
+
+    result = app.test_cli_runner().invoke(args=["compile-templates"])
+    assert "Compiled" in result.output
+
+    # one bytecode file per template
+    templates = app.jinja_env.list_templates(extensions=("html",))
+    assert len(os.listdir(cache_dir)) == len(templates)
+
+
+def test_compile_templates_without_cache(runner):
+    result = runner.invoke(args=["compile-templates"])
+    assert result.exit_code != 0
+    assert "TEMPLATE_CACHE_DIR is not set" in result.output
+
+
+def test_warm_up(app):
+    app.config["DATABASE_POOL_SIZE"] = 2
+    close_pool(app)
+    warm_up(app)
+
+    assert len(app.jinja_env.cache) == len(app.jinja_env.list_templates(extensions=("html",)))
+    assert get_pool(app)._idle.qsize() == 2
+    assert get_pool(app, readonly=True)._idle.qsize() == 2
+
+
+def test_warm_up_on_create(app):
+    app = create_app({
+        "TESTING": True,
+        "DATABASE": app.config["DATABASE"],
+        "TEMPLATE_CACHE_DIR": None,
+        "WARM_UP": True,
+    })
+    assert get_pool(app)._idle.qsize() == app.config["DATABASE_POOL_SIZE"]
+    close_pool(app)